@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+# Bounds for the process-wide cache shared by every Streamlit session
+MAX_ENTRIES = 5000
+MAX_AGE_SECONDS = 300  # Caps staleness from writes made by other processes
+
+
+@dataclass(frozen=True, slots=True)
+class BookRecord:
+    """Immutable snapshot of the book columns the pages display."""
+    book_id: int
+    title: str
+    isbn: Optional[str]
+    authors: tuple
+    publication_year: Optional[date]
+    cover_image_url: Optional[str]
+    rating_count: int
+    average_rating: float
+
+    @classmethod
+    def from_book(cls, book):
+        return cls(
+            book_id=book.book_id,
+            title=book.title,
+            isbn=book.isbn,
+            authors=tuple(book.authors or ()),
+            publication_year=book.publication_year,
+            cover_image_url=book.cover_image_url,
+            rating_count=book.rating_count or 0,
+            average_rating=book.average_rating or 0.0,
+        )
+
+
+_entries = OrderedDict()  # book_id -> (loaded_at, BookRecord), least recently used first
+_lock = threading.Lock()
+
+
+def get_cached(book_ids):
+    """
+    Look up books in the cache.
+
+    Args:
+        book_ids (iterable): Book IDs to look up
+
+    Returns:
+        tuple: (dict of book_id -> BookRecord for hits, list of missed book_ids)
+    """
+    now = time.monotonic()
+    hits, misses = {}, []
+    with _lock:
+        for book_id in book_ids:
+            entry = _entries.get(book_id)
+            if entry is None or now - entry[0] > MAX_AGE_SECONDS:
+                misses.append(book_id)
+                continue
+            _entries.move_to_end(book_id)
+            hits[book_id] = entry[1]
+    return hits, misses
+
+
+def store(records):
+    """Add or replace records, evicting the least recently used beyond MAX_ENTRIES."""
+    now = time.monotonic()
+    with _lock:
+        for record in records:
+            _entries[record.book_id] = (now, record)
+            _entries.move_to_end(record.book_id)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def invalidate(book_ids):
+    """Drop cached records for books whose row changed."""
+    with _lock:
+        for book_id in book_ids:
+            _entries.pop(book_id, None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
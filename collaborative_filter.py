@@ -3,9 +3,8 @@ import bcrypt
 import pandas as pd
 from scipy.sparse import coo_matrix
 from sklearn.metrics.pairwise import cosine_similarity
-from sqlalchemy import create_engine
 
-from models import DATABASE_URL
+from models import engine
 
 
 def get_user_liked_books(user_id: int):
@@ -18,9 +17,6 @@ def get_user_liked_books(user_id: int):
     Returns:
         pd.DataFrame: DataFrame with columns ['user_id', 'book_id', 'rating', 'rated_date']
     """
-    # Create a database engine
-    engine = create_engine(DATABASE_URL)
-    
     try:
         # SQL query to fetch all rated books
         query = """
@@ -48,10 +44,6 @@ def get_user_liked_books(user_id: int):
     except Exception as e:
         print(f"Error fetching user liked books: {str(e)}")
         return pd.DataFrame(columns=['user_id', 'book_id', 'rating', 'rated_date'])
-    
-    finally:
-        # Dispose of the engine connection
-        engine.dispose()
 
 
 def get_overlap_users(user_id: int, user_liked_books: pd.DataFrame, min_overlap_percentage: float = 0.20):
@@ -75,9 +67,6 @@ def get_overlap_users(user_id: int, user_liked_books: pd.DataFrame, min_overlap_
     # Extract the book_ids of the target user's liked books
     liked_book_ids = tuple(user_liked_books['book_id'].tolist())
     
-    # Create a database engine
-    engine = create_engine(DATABASE_URL)
-    
     try:
         # SQL query to find users who rated the same books, excluding the target user
         query = """
@@ -112,10 +101,6 @@ def get_overlap_users(user_id: int, user_liked_books: pd.DataFrame, min_overlap_
     except Exception as e:
         print(f"Error generating overlap users DataFrame: {str(e)}")
         return pd.DataFrame(columns=['user_id', 'frequency', 'overlap_percentage'])
-    
-    finally:
-        # Dispose of the engine connection
-        engine.dispose()
 
 
 def get_similar_user_liked_books(user_id: int, overlap_users: pd.DataFrame):
@@ -134,7 +119,6 @@ def get_similar_user_liked_books(user_id: int, overlap_users: pd.DataFrame):
         all_ratings = get_user_liked_books(user_id)
     else:
         similar_user_ids = tuple(overlap_users['user_id'].tolist() + [user_id])
-        engine = create_engine(DATABASE_URL)
         
         try:
             query = """
@@ -147,8 +131,6 @@ def get_similar_user_liked_books(user_id: int, overlap_users: pd.DataFrame):
         except Exception as e:
             print(f"Error fetching ratings for similar users: {str(e)}")
             return pd.DataFrame(columns=['user_id', 'book_id', 'rating', 'rated_date', 'user_index', 'book_index'])
-        finally:
-            engine.dispose()
     
     if all_ratings.empty:
         print(f"No ratings found for similar users or target user {user_id}")
@@ -198,7 +180,6 @@ def add_book_metadata(book_recs: pd.DataFrame):
         return pd.DataFrame(columns=['book_id', 'count', 'mean', 'rating_count', 'mod_title'])
 
     # Fetch rating_count and mod_title from the books table
-    engine = create_engine(DATABASE_URL)
     try:
         # Query to get rating_count and mod_title for all books in book_recs
         book_ids = tuple(book_recs['book_id'].tolist())
@@ -211,8 +192,6 @@ def add_book_metadata(book_recs: pd.DataFrame):
     except Exception as e:
         print(f"Error fetching rating counts from books table: {str(e)}")
         book_counts = pd.DataFrame(columns=['book_id', 'rating_count', 'mod_title'])
-    finally:
-        engine.dispose()
 
     # Merge rating_count and mod_title with book_recs
     book_recs = book_recs.merge(book_counts, on='book_id', how='left')
@@ -229,7 +208,6 @@ def get_recommendations(user_id: int):
     user_liked_books = get_user_liked_books(user_id)
     
     # Fetch mod_title for the user's liked books
-    engine = create_engine(DATABASE_URL)
     try:
         liked_book_ids = tuple(user_liked_books['book_id'].tolist())
         query = """
@@ -243,8 +221,6 @@ def get_recommendations(user_id: int):
     except Exception as e:
         print(f"Error fetching mod_title for user liked books: {str(e)}")
         user_liked_books['mod_title'] = ''
-    finally:
-        engine.dispose()
 
     # Find users with significant overlap
     overlap_users = get_overlap_users(user_id, user_liked_books)
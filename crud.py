@@ -1,20 +1,30 @@
 from datetime import datetime, timezone
 
 import bcrypt
-from sqlalchemy import func, update
+from sqlalchemy import Sequence, func, select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from models import Book, ListedBook, RequestedBook, User, UserBookRating
+import book_cache
+from database import enable_bulk_ratings
+from models import (
+    LIST_ID_SEQUENCE,
+    Book,
+    ListedBook,
+    RequestedBook,
+    User,
+    UserBookRating,
+)
+
+# Rows per multi-row INSERT in the bulk APIs
+BULK_CHUNK_SIZE = 1000
 
 
 def create_user(db: Session, name: str, user_name: str, birth_year: datetime, password: str, city_id: int):
-    max_id = db.query(func.max(User.user_id)).scalar() or 0
-    
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
     age = datetime.now().year - birth_year.year
     db_user = User(
-        user_id = max_id + 1,
         name=name,
         user_name=user_name,
         birth_year=birth_year,
@@ -38,6 +48,29 @@ def create_user(db: Session, name: str, user_name: str, birth_year: datetime, pa
             print(f"error creating user: {str(e.orig)}")
         return None
 
+def reserve_ids(db: Session, sequence: Sequence, count: int):
+    """
+    Prefetch a batch of ids from a sequence in a single round trip.
+
+    Bulk paths use this to assign keys up front instead of calling nextval()
+    once per row. Ids are unique across sessions but not necessarily
+    contiguous.
+
+    Args:
+        db (Session): Database session
+        sequence (Sequence): One of the ID sequences defined in models
+        count (int): Number of ids to reserve
+
+    Returns:
+        list: Reserved ids in ascending order
+    """
+    if count <= 0:
+        return []
+    ids = db.execute(
+        select(sequence.next_value()).select_from(func.generate_series(1, count))
+    ).scalars().all()
+    return sorted(ids)
+
 def get_user(db: Session, user_id: int):
     return db.query(User).filter(User.user_id == user_id).first()
 
@@ -51,36 +84,108 @@ def verify_user(db: Session, name: str, password: str):
     return None
 
 def create_book(db: Session, book_data: dict):
-    # Get the maximum book_id from the books table, default to 0 if table is empty
-    max_id = db.query(func.max(Book.book_id)).scalar() or 0
-    new_book_id = max_id + 1
-    
-    # Create the book object with the new book_id
-    db_book = Book(
-        book_id=new_book_id,  # Explicitly set the book_id
-        **book_data
-    )
+    # book_id is assigned from books_book_id_seq on insert
+    db_book = Book(**book_data)
     db.add(db_book)
     db.commit()
     db.refresh(db_book)
+    book_cache.invalidate([db_book.book_id])
     return db_book
 
 def get_book(db: Session, book_id: int):
-    return db.query(Book).filter(Book.book_id == book_id).first()
+    """
+    Get a book's metadata through the process-wide book cache.
+
+    Returns:
+        BookRecord or None: Immutable snapshot of the book if it exists
+    """
+    books = get_books(db, [book_id])
+    return books[0] if books else None
+
+def get_books(db: Session, book_ids):
+    """
+    Get metadata for several books, reading only cache misses from the
+    database in a single query.
+
+    Args:
+        db (Session): Database session
+        book_ids (iterable): Book IDs to fetch
+
+    Returns:
+        list: BookRecord objects in the order of book_ids, skipping unknown IDs
+    """
+    book_ids = list(dict.fromkeys(int(book_id) for book_id in book_ids))
+    found, misses = book_cache.get_cached(book_ids)
+    if misses:
+        records = [
+            book_cache.BookRecord.from_book(book)
+            for book in db.query(Book).filter(Book.book_id.in_(misses)).all()
+        ]
+        book_cache.store(records)
+        found.update((record.book_id, record) for record in records)
+    return [found[book_id] for book_id in book_ids if book_id in found]
 
 def list_book(db: Session, user_id: int, book_id: int):
-    list_id = db.query(func.max(ListedBook.list_id)).scalar() or 0
-    db_listed_book = ListedBook(
-        list_id=list_id + 1,
+    # list_id is assigned from listed_books_list_id_seq on insert; listing a
+    # book again just refreshes its listed_date, as in bulk_list_books
+    stmt = insert(ListedBook).values(
         user_id=user_id,
         book_id=book_id,
         listed_date=datetime.now(timezone.utc)  # Updated to timezone-aware UTC
     )
-    db.add(db_listed_book)
-    db.commit()
-    db.refresh(db_listed_book)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ListedBook.user_id, ListedBook.book_id],
+        set_={"listed_date": stmt.excluded.listed_date},
+    ).returning(ListedBook)
+    try:
+        db_listed_book = db.scalars(stmt, execution_options={"populate_existing": True}).one()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     return db_listed_book
 
+def bulk_list_books(db: Session, pairs):
+    """
+    List many books in a single transaction.
+
+    Rows are written with multi-row INSERT ... ON CONFLICT DO UPDATE, so a
+    book the user has already listed just gets a fresh listed_date.
+
+    Args:
+        db (Session): Database session
+        pairs (iterable): (user_id, book_id) tuples
+
+    Returns:
+        int: Number of listings inserted or refreshed
+    """
+    pairs = list(dict.fromkeys((int(user_id), int(book_id)) for user_id, book_id in pairs))
+    if not pairs:
+        return 0
+
+    list_ids = reserve_ids(db, LIST_ID_SEQUENCE, len(pairs))
+    now = datetime.now(timezone.utc)
+    written = 0
+    try:
+        for start in range(0, len(pairs), BULK_CHUNK_SIZE):
+            rows = [
+                {"list_id": list_id, "user_id": user_id, "book_id": book_id, "listed_date": now}
+                for list_id, (user_id, book_id) in zip(
+                    list_ids[start:start + BULK_CHUNK_SIZE], pairs[start:start + BULK_CHUNK_SIZE]
+                )
+            ]
+            stmt = insert(ListedBook).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ListedBook.user_id, ListedBook.book_id],
+                set_={"listed_date": stmt.excluded.listed_date},
+            )
+            written += db.execute(stmt).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return written
+
 def remove_listed_book(db: Session, user_id: int, book_id: int):
     db_listed_book = db.query(ListedBook).filter(
         ListedBook.user_id == user_id, ListedBook.book_id == book_id
@@ -131,6 +236,7 @@ def rate_book(db: Session, user_id: int, book_id: int, rating: int):
         existing_rating.rating = rating
         existing_rating.rated_date = now
         db.commit()
+        book_cache.invalidate([book_id])  # The trigger changed the book's rating columns
         db.refresh(existing_rating)
         return existing_rating
     else:
@@ -143,9 +249,60 @@ def rate_book(db: Session, user_id: int, book_id: int, rating: int):
         )
         db.add(db_rating)
         db.commit()
+        book_cache.invalidate([book_id])  # The trigger changed the book's rating columns
         db.refresh(db_rating)
         return db_rating
 
+def bulk_rate(db: Session, rows):
+    """
+    Insert or update many ratings in a single transaction.
+
+    Rows are written with multi-row INSERT ... ON CONFLICT DO UPDATE in bulk
+    rating mode, so rating_count and average_rating are recomputed once per
+    statement for the affected books. When the same (user_id, book_id)
+    appears more than once the last rating wins, and ratings for unknown
+    books are skipped.
+
+    Args:
+        db (Session): Database session
+        rows (iterable): (user_id, book_id, rating) tuples
+
+    Returns:
+        int: Number of ratings inserted or updated
+    """
+    ratings = {}
+    for user_id, book_id, rating in rows:
+        ratings[(int(user_id), int(book_id))] = int(rating)
+    if not ratings:
+        return 0
+
+    now = datetime.now(timezone.utc)
+    written = 0
+    try:
+        known_books = set(db.execute(
+            select(Book.book_id).where(Book.book_id.in_({book_id for _, book_id in ratings}))
+        ).scalars())
+        values = [
+            {"user_id": user_id, "book_id": book_id, "rating": rating, "rated_date": now}
+            for (user_id, book_id), rating in ratings.items()
+            if book_id in known_books
+        ]
+
+        enable_bulk_ratings(db)
+        for start in range(0, len(values), BULK_CHUNK_SIZE):
+            stmt = insert(UserBookRating).values(values[start:start + BULK_CHUNK_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[UserBookRating.user_id, UserBookRating.book_id],
+                set_={"rating": stmt.excluded.rating, "rated_date": stmt.excluded.rated_date},
+            )
+            written += db.execute(stmt).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    book_cache.invalidate(known_books)
+    return written
+
 def remove_rating(db: Session, user_id: int, book_id: int):
     """
     Remove a user's rating for a specific book.
@@ -165,6 +322,7 @@ def remove_rating(db: Session, user_id: int, book_id: int):
     if rating:
         db.delete(rating)
         db.commit()
+        book_cache.invalidate([book_id])
         return True
     return False
 
@@ -177,7 +335,7 @@ def get_trending_books(db: Session, limit: int = 10):
     )
 
 def get_book_details(db: Session, book_id: int):
-    return db.query(Book).filter(Book.book_id == book_id).first()
+    return get_book(db, book_id)
 
 def get_user_book_rating(db: Session, user_id: int, book_id: int):
     """
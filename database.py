@@ -1,13 +1,94 @@
+import argparse
 import contextlib
+import threading
+from datetime import datetime
 
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
-from models import Base, SessionLocal, engine, init_triggers  # Import init_triggers
+from models import (
+    BULK_RATINGS_SETTING,
+    SCHEMA_VERSION,
+    Base,
+    SchemaVersion,
+    SessionLocal,
+    engine,
+    init_triggers,
+)
 
+# Advisory lock key serializing the bootstrap across processes
+SCHEMA_LOCK_ID = 0x626F6F78  # "boox"
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
-    init_triggers()  # Initialize the Bayesian rating trigger
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def get_schema_version(connection):
+    """Return the schema version recorded in the database, or 0 if none."""
+    if connection.execute(text("SELECT to_regclass('schema_version')")).scalar() is None:
+        return 0
+    version = connection.execute(
+        text("SELECT version FROM schema_version WHERE version_id = 1")
+    ).scalar()
+    return version or 0
+
+
+def init_db(force=False):
+    """
+    Bootstrap the schema: create missing tables, run the DDL in
+    models.init_triggers() and record SCHEMA_VERSION.
+
+    Every step is idempotent, and a database already at SCHEMA_VERSION is left
+    untouched unless force is set. Concurrent bootstraps (several app
+    processes starting at once) are serialized with an advisory lock.
+
+    Returns:
+        bool: True if the bootstrap ran, False if the schema was current
+    """
+    with engine.connect() as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_ID})
+        try:
+            current = get_schema_version(connection)
+            connection.commit()
+            if current >= SCHEMA_VERSION and not force:
+                return False
+
+            print(f"Bootstrapping database schema {current} -> {SCHEMA_VERSION}")
+            Base.metadata.create_all(bind=engine)
+            init_triggers()  # Initialize the Bayesian rating trigger and other DDL
+            connection.execute(
+                insert(SchemaVersion)
+                .values(version_id=1, version=SCHEMA_VERSION, applied_at=datetime.utcnow())
+                .on_conflict_do_update(
+                    index_elements=[SchemaVersion.version_id],
+                    set_={"version": SCHEMA_VERSION, "applied_at": datetime.utcnow()},
+                )
+            )
+            connection.commit()
+            return True
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_ID})
+            connection.commit()
+
+
+def ensure_schema():
+    """
+    Cheap startup check for the app: after the first call in a process this
+    is a flag lookup. The first call reads the recorded schema version and
+    only runs init_db() when the database is behind.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with engine.connect() as connection:
+            current = get_schema_version(connection)
+        if current < SCHEMA_VERSION:
+            init_db()
+        _schema_ready = True
 
 @contextlib.contextmanager
 def get_db():
@@ -15,4 +96,54 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def enable_bulk_ratings(connection):
+    """
+    Switch user_book_ratings inserts on this connection or session to bulk mode
+    for the rest of the current transaction.
+
+    The row-level Bayesian trigger is skipped for inserts and a statement-level
+    trigger recomputes rating_count/average_rating for the affected books once
+    per INSERT statement, so batch loads should use multi-row inserts.
+    """
+    connection.execute(
+        text("SELECT set_config(:name, 'on', true)"),
+        {"name": BULK_RATINGS_SETTING},
+    )
+
+def defer_rating_aggregates(connection):
+    """
+    Skip all rating aggregate maintenance for user_book_ratings inserts on
+    this connection for the rest of the current transaction.
+
+    Meant for full loads: the caller must run SELECT rebuild_rating_aggregates()
+    before committing, which recomputes every book in one set-based pass.
+    """
+    connection.execute(
+        text("SELECT set_config(:name, 'deferred', true)"),
+        {"name": BULK_RATINGS_SETTING},
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or upgrade the Booxchange database schema.")
+    parser.add_argument("--force", action="store_true", help="re-run every setup step even if the schema is current")
+    parser.add_argument(
+        "--archive-messages",
+        type=int,
+        metavar="MONTHS",
+        help="move message partitions older than MONTHS months into the compressed archive",
+    )
+    args = parser.parse_args()
+    if init_db(force=args.force):
+        print(f"Database schema is at version {SCHEMA_VERSION}")
+    else:
+        print(f"Database schema already at version {SCHEMA_VERSION}")
+
+    if args.archive_messages is not None:
+        # messaging imports get_db from this module
+        from messaging import archive_old_messages
+
+        archived = archive_old_messages(months_to_keep=args.archive_messages)
+        print(f"Archived {archived} monthly message partitions")
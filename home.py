@@ -1,15 +1,15 @@
+import importlib
+
 import streamlit as st
 
-from database import get_db, init_db
+from database import ensure_schema, get_db
+from instrumentation import debug_panel, timed_page
 from models import ListedBook
-from pages.books import listed_books_page
-from pages.login import login_page
-from pages.messages import messages_page
-from pages.recommendations import display_recommendations
-from pages.wall import display_wall
+from thumbnails import cover_source
 from trending import get_trending_books_simple
 
 
+@timed_page("trending")
 def display_trending():
     st.title("Trending Books")
 
@@ -31,7 +31,7 @@ def display_trending():
                 col1, col2 = st.columns([1, 3])
                 with col1:
                     if book.cover_image_url:
-                        st.image(book.cover_image_url, width=100)
+                        st.image(cover_source(book.cover_image_url, 100), width=100)
                     else:
                         st.write("No cover")
                 with col2:
@@ -52,11 +52,33 @@ def display_trending():
                     st.write("---")
 
 
+# Navigation entry -> "module:function". Page modules (and the pandas/sklearn
+# stack some of them pull in) are only imported when a page is first shown.
+PAGES = {
+    "Home": "pages.wall:display_wall",
+    "Login/Register": "pages.login:login_page",
+    "Wall": "pages.wall:display_wall",
+    "Trending": display_trending,
+    "Recommendations": "pages.recommendations:display_recommendations",
+    "My Books": "pages.books:listed_books_page",
+    "Messages": "pages.messages:messages_page",
+}
+
+
+def load_page(name):
+    """Return the render function for a navigation entry, importing its module on first use."""
+    page = PAGES[name]
+    if callable(page):
+        return page
+    module_name, function_name = page.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
 def main():
     st.set_page_config(page_title="Booxchange", layout="wide")
     
-    # Initialize database
-    init_db()
+    # Bootstrap the schema once per process if the database is behind
+    ensure_schema()
     
     # Initialize session state
     if 'user_id' not in st.session_state:
@@ -69,10 +91,8 @@ def main():
             ["Home", "Login/Register"]
         )
         
-        if page == "Home":
-            display_wall()
-        elif page == "Login/Register":
-            login_page()
+        load_page(page)()
+        debug_panel()
     else:
         st.sidebar.write(f"Welcome back!")
         
@@ -81,16 +101,8 @@ def main():
             ["Wall", "Trending", "Recommendations", "My Books", "Messages"]
         )
         
-        if page == "Wall":
-            display_wall()
-        elif page == "Trending":
-            display_trending()
-        elif page == "Recommendations":
-            display_recommendations()
-        elif page == "My Books":
-            listed_books_page()
-        elif page == "Messages":
-            messages_page()
+        load_page(page)()
+        debug_panel()
             
         if st.sidebar.button("Logout"):
             st.session_state.user_id = None
@@ -0,0 +1,71 @@
+"""
+Check how long importing the app takes, using `python -X importtime`.
+
+Usage:
+    python import_budget.py [--module home] [--budget-ms 1500] [--top 15]
+
+Exits non-zero when the import exceeds the budget or pulls in a module that
+should only be loaded lazily (pandas, scipy, scikit-learn).
+"""
+import argparse
+import subprocess
+import sys
+
+# Heavy packages that must not be imported until a page needs them
+LAZY_MODULES = ("pandas", "scipy", "sklearn")
+
+
+def measure_imports(module):
+    """
+    Import a module in a fresh interpreter and collect -X importtime output.
+
+    Args:
+        module (str): Module to import
+
+    Returns:
+        list: (module name, self microseconds, cumulative microseconds) per imported module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((name.strip(), int(self_us), int(cumulative_us)))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the app's import-time budget.")
+    parser.add_argument("--module", default="home", help="module to import (default: home)")
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="maximum cumulative import time")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to list")
+    args = parser.parse_args()
+
+    timings = measure_imports(args.module)
+    total_ms = next(cumulative for name, _, cumulative in timings if name == args.module) / 1000
+
+    print(f"import {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    print("Slowest top-level packages (cumulative):")
+    top_level = [entry for entry in timings if "." not in entry[0]]
+    for name, _, cumulative in sorted(top_level, key=lambda entry: entry[2], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    eager = sorted({name for name, _, _ in timings if name.split(".")[0] in LAZY_MODULES and "." not in name})
+    ok = total_ms <= args.budget_ms
+    if eager:
+        print(f"Imported eagerly but should be lazy: {', '.join(eager)}")
+        ok = False
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
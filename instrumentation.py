@@ -0,0 +1,272 @@
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import streamlit as st
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
+
+from models import engine
+
+# Statements kept per render, slowest first
+SLOWEST_STATEMENTS = 5
+STATEMENT_PREVIEW_CHARS = 300
+# Set BOOXCHANGE_DEBUG_PANEL=1 to show the timing breakdown in the sidebar
+DEBUG_PANEL = os.getenv("BOOXCHANGE_DEBUG_PANEL") == "1"
+
+# Slow query log: statements at or above the threshold are logged, and a
+# sample of the SELECTs among them is re-run with EXPLAIN ANALYZE in the
+# background. Plans are fingerprinted by their shape (node types, relations,
+# indexes, join strategies) so a changed plan for the same query is flagged.
+SLOW_QUERY_MS = float(os.getenv("BOOXCHANGE_SLOW_QUERY_MS", "200"))
+EXPLAIN_SAMPLE_RATE = float(os.getenv("BOOXCHANGE_EXPLAIN_SAMPLE_RATE", "0.1"))
+SLOW_QUERY_LOG = os.getenv("BOOXCHANGE_SLOW_QUERY_LOG", "slow_query_plans.jsonl")
+EXPLAIN_TIMEOUT_MS = 30000
+MAX_PENDING_EXPLAINS = 8
+# EXPLAIN ANALYZE executes the statement again: only plain reads are
+# explained, never SELECTs that lock rows or call functions with side effects
+EXPLAINABLE_STATEMENT = re.compile(r"^select\b.*\bfrom\b", re.IGNORECASE | re.DOTALL)
+SIDE_EFFECT_PATTERN = re.compile(
+    r"\b(nextval|setval|set_config|pg_advisory\w*|pg_try_advisory\w*|pg_notify|"
+    r"sync_id_sequence|ensure_message_partitions?|archive_message_partitions|rebuild_rating_aggregates)\s*\("
+    r"|\bfor\s+(update|no\s+key\s+update|share|key\s+share)\b",
+    re.IGNORECASE,
+)
+PLAN_SHAPE_KEYS = ("Node Type", "Parent Relationship", "Join Type", "Strategy", "Relation Name", "Index Name", "Scan Direction")
+
+# One JSON object per page render; BOOXCHANGE_PERF_LOG sends them to a file instead of stderr
+logger = logging.getLogger("booxchange.perf")
+if not logger.handlers:
+    log_path = os.getenv("BOOXCHANGE_PERF_LOG")
+    handler = logging.FileHandler(log_path) if log_path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+@dataclass
+class RenderStats:
+    """Database activity during one page render."""
+    page: str
+    started_at: float = field(default_factory=time.perf_counter)
+    total_seconds: float = 0.0
+    query_count: int = 0
+    db_seconds: float = 0.0
+    slowest: list = field(default_factory=list)  # (seconds, statement), slowest first
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, statement, seconds):
+        with self._lock:
+            self.query_count += 1
+            self.db_seconds += seconds
+            if len(self.slowest) < SLOWEST_STATEMENTS or seconds > self.slowest[-1][0]:
+                self.slowest.append((seconds, " ".join(statement.split())[:STATEMENT_PREVIEW_CHARS]))
+                self.slowest.sort(key=lambda entry: entry[0], reverse=True)
+                del self.slowest[SLOWEST_STATEMENTS:]
+
+    def as_dict(self):
+        return {
+            "event": "page_render",
+            "page": self.page,
+            "duration_ms": round(self.total_seconds * 1000, 1),
+            "query_count": self.query_count,
+            "db_ms": round(self.db_seconds * 1000, 1),
+            "slowest": [
+                {"ms": round(seconds * 1000, 1), "statement": statement}
+                for seconds, statement in self.slowest
+            ],
+        }
+
+
+# Render being timed in the current script run; queries from background
+# threads (prefetch, thumbnails) run outside it and are not counted
+_current_render = contextvars.ContextVar("booxchange_render", default=None)
+
+
+# Listeners are attached to every Engine, so queries through any engine count
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started_at"].pop()
+    stats = _current_render.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+    if seconds * 1000 >= SLOW_QUERY_MS and not _explaining.get():
+        _log_slow_query(statement, parameters, seconds, executemany, stats)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get("query_started_at"):
+        context.connection.info["query_started_at"].pop()
+
+
+_explaining = contextvars.ContextVar("booxchange_explaining", default=False)
+_explain_executor = None
+_explain_engine = None
+_explain_slots = threading.BoundedSemaphore(MAX_PENDING_EXPLAINS)
+_explain_lock = threading.Lock()
+_known_plans = None  # query fingerprint -> last plan fingerprint, loaded from SLOW_QUERY_LOG
+
+
+def _fingerprint(value):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+def plan_shape(plan):
+    """Reduce an EXPLAIN (FORMAT JSON) plan node to its structure, without costs, rows or timings."""
+    return {
+        **{key: plan[key] for key in PLAN_SHAPE_KEYS if key in plan},
+        "Plans": [plan_shape(child) for child in plan.get("Plans", [])],
+    }
+
+
+def is_explainable(statement):
+    """Whether a statement is a plain read that is safe to execute again under EXPLAIN ANALYZE."""
+    return bool(EXPLAINABLE_STATEMENT.match(statement)) and not SIDE_EFFECT_PATTERN.search(statement)
+
+
+def _get_explain_engine():
+    """Engine for EXPLAIN runs; NullPool so their connections never return to the app's pool."""
+    global _explain_engine
+    with _explain_lock:
+        if _explain_engine is None:
+            _explain_engine = create_engine(engine.url, poolclass=NullPool)
+        return _explain_engine
+
+
+def _log_slow_query(statement, parameters, seconds, executemany, stats):
+    global _explain_executor
+    normalized = " ".join(statement.split())
+    logger.warning(json.dumps({
+        "event": "slow_query",
+        "page": stats.page if stats else None,
+        "ms": round(seconds * 1000, 1),
+        "query_id": _fingerprint(normalized),
+        "statement": normalized[:STATEMENT_PREVIEW_CHARS],
+    }))
+
+    # Only reads issued by a page render are sampled (see EXPLAINABLE_STATEMENT)
+    if stats is None or executemany or not is_explainable(normalized) or random.random() >= EXPLAIN_SAMPLE_RATE:
+        return
+    if not _explain_slots.acquire(blocking=False):
+        return
+    with _explain_lock:
+        if _explain_executor is None:
+            _explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+    future = _explain_executor.submit(_explain, statement, parameters, seconds)
+    future.add_done_callback(lambda _: _explain_slots.release())
+
+
+def _explain(statement, parameters, seconds):
+    """Re-run a slow SELECT with EXPLAIN ANALYZE on its own connection and record the plan."""
+    _explaining.set(True)
+    normalized = " ".join(statement.split())
+    try:
+        with _get_explain_engine().connect() as connection:
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+            result = connection.exec_driver_sql(
+                "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters
+            ).scalar()
+            connection.rollback()
+    except Exception as e:
+        print(f"Could not EXPLAIN slow query: {e}")
+        return
+
+    explained = (json.loads(result) if isinstance(result, str) else result)[0]
+    _record_plan(normalized, seconds, explained)
+
+
+def _record_plan(normalized, seconds, explained):
+    global _known_plans
+    query_id = _fingerprint(normalized)
+    plan_id = _fingerprint(json.dumps(plan_shape(explained["Plan"]), sort_keys=True))
+
+    with _explain_lock:
+        if _known_plans is None:
+            _known_plans = {}
+            if os.path.exists(SLOW_QUERY_LOG):
+                with open(SLOW_QUERY_LOG, encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        _known_plans[entry["query_id"]] = entry["plan_id"]
+        previous = _known_plans.get(query_id)
+        _known_plans[query_id] = plan_id
+
+        with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "recorded_at": datetime.utcnow().isoformat(),
+                "query_id": query_id,
+                "plan_id": plan_id,
+                "previous_plan_id": previous,
+                "ms": round(seconds * 1000, 1),
+                "explain_ms": explained.get("Execution Time"),
+                "statement": normalized,
+                # The full plan is kept when it is new or has changed
+                "plan": explained if plan_id != previous else None,
+            }) + "\n")
+
+    if previous is not None and previous != plan_id:
+        logger.warning(json.dumps({
+            "event": "plan_changed",
+            "query_id": query_id,
+            "previous_plan_id": previous,
+            "plan_id": plan_id,
+            "statement": normalized[:STATEMENT_PREVIEW_CHARS],
+        }))
+
+
+def timed_page(page):
+    """
+    Decorator timing a page render: total time, query count, DB time and the
+    slowest statements are logged as JSON and kept for the debug panel.
+
+    Args:
+        page (str): Name the render is reported under
+    """
+    def decorator(render):
+        @functools.wraps(render)
+        def wrapper(*args, **kwargs):
+            stats = RenderStats(page)
+            token = _current_render.set(stats)
+            try:
+                return render(*args, **kwargs)
+            finally:
+                # Also reached through st.rerun()/st.switch_page(), which raise
+                _current_render.reset(token)
+                stats.total_seconds = time.perf_counter() - stats.started_at
+                logger.info(json.dumps(stats.as_dict()))
+                st.session_state.last_render_stats = stats
+        return wrapper
+    return decorator
+
+
+def debug_panel():
+    """Show the last page render's timing breakdown in the sidebar when DEBUG_PANEL is on."""
+    stats = st.session_state.get("last_render_stats")
+    if not DEBUG_PANEL or stats is None:
+        return
+    with st.sidebar.expander("Performance", expanded=False):
+        st.write(f"Page: {stats.page}")
+        st.write(f"Render: {stats.total_seconds * 1000:.0f} ms")
+        st.write(f"Queries: {stats.query_count} ({stats.db_seconds * 1000:.0f} ms in the database)")
+        for seconds, statement in stats.slowest:
+            st.caption(f"{seconds * 1000:.1f} ms")
+            st.code(statement, language="sql")
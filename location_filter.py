@@ -1,52 +1,177 @@
-from sqlalchemy import desc
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Float, Integer, column, desc, func, text, values
 
 from database import get_db
-from models import (
-    Book,
-    City,
-    District,
-    DistrictCity,
-    ListedBook,
-    Province,
-    ProvinceDistrict,
-    User,
-)
+from location_tree import get_location_tree
+from models import Book, City, ListingLocation, User
+from pagination import after_cursor, next_cursor
 from utils import search
 
 
+@dataclass(frozen=True, slots=True)
+class ListingRow:
+    """One listing as rendered by the wall and recommendation feeds."""
+    list_id: int
+    book_id: int
+    user_id: int
+    title: str
+    cover_image_url: Optional[str]
+    average_rating: float
+    listed_date: datetime
+    city_name: str
+    distance_km: Optional[float] = None
+
+
+def listing_rows_query(db, *extra_columns):
+    """Select the ListingRow columns from listing_locations joined to books and city."""
+    return (
+        db.query(
+            ListingLocation.list_id,
+            ListingLocation.book_id,
+            ListingLocation.user_id,
+            Book.title,
+            Book.cover_image_url,
+            Book.average_rating,
+            ListingLocation.listed_date,
+            City.name,
+            *extra_columns,
+        )
+        .select_from(ListingLocation)
+        .join(Book, ListingLocation.book_id == Book.book_id)
+        .join(City, ListingLocation.city_id == City.city_id)
+    )
+
+
+def filter_by_location(query, province_id=None, district_id=None, city_id=None):
+    """Restrict a listing_locations query to the most specific location given."""
+    if city_id:
+        return query.filter(ListingLocation.city_id == city_id)
+    if district_id:
+        return query.filter(ListingLocation.district_id == district_id)
+    if province_id:
+        return query.filter(ListingLocation.province_id == province_id)
+    return query
+
+
+def _listing_cursor_key(row):
+    return row.listed_date, row.list_id
+
+
 def get_provinces():
-    """Fetch all provinces from the database."""
-    with get_db() as db:
-        provinces = db.query(Province).order_by(Province.name).all()
-        return {province.name: province.province_id for province in provinces}
+    """Fetch all provinces from the in-memory location tree."""
+    return get_location_tree().provinces()
 
 
 def get_districts(province_id=None):
     """Fetch districts, optionally filtered by province."""
-    with get_db() as db:
-        query = db.query(District).join(ProvinceDistrict).filter(ProvinceDistrict.district_id == District.district_id)
-        if province_id:
-            query = query.filter(ProvinceDistrict.province_id == province_id)
-        districts = query.order_by(District.name).all()
-        return {district.name: district.district_id for district in districts}
+    return get_location_tree().districts(province_id)
 
 
 def get_cities(district_id=None):
     """Fetch cities, optionally filtered by district."""
+    return get_location_tree().cities(district_id)
+
+
+# Listing counts are shared by all sessions for a short time so the wall's
+# dropdowns do not regroup listings on every rerun
+FACET_TTL_SECONDS = 30
+FACET_CACHE_SIZE = 256
+_facet_cache = {}  # search_query -> (computed_at, facets)
+_facet_lock = threading.Lock()
+
+
+def get_listing_facets(search_query=None):
+    """
+    Count listed books per province, district and city in one grouped query.
+    
+    Args:
+        search_query (str): Optional search term; counts only matching books
+    
+    Returns:
+        dict: {"total": int, "province": {province_id: count},
+        "district": {district_id: count}, "city": {city_id: count}}
+    """
+    search_query = search_query or None
+    with _facet_lock:
+        cached = _facet_cache.get(search_query)
+    if cached and time.monotonic() - cached[0] < FACET_TTL_SECONDS:
+        return cached[1]
+
     with get_db() as db:
-        query = db.query(City).join(DistrictCity).filter(DistrictCity.city_id == City.city_id)
-        if district_id:
-            query = query.filter(DistrictCity.district_id == district_id)
-        cities = query.order_by(City.name).all()
-        return {city.name: city.city_id for city in cities}
+        # grouping() is a bitmask of the columns not grouped in each set, so
+        # NULL location ids are not confused with rolled-up rows
+        query = db.query(
+            func.grouping(ListingLocation.province_id, ListingLocation.district_id, ListingLocation.city_id),
+            ListingLocation.province_id,
+            ListingLocation.district_id,
+            ListingLocation.city_id,
+            func.count(),
+        )
+        if search_query:
+            query = query.filter(ListingLocation.book_id.in_(matched_book_ids(search_query)))
+        rows = query.group_by(text("GROUPING SETS ((province_id), (district_id), (city_id), ())")).all()
+
+    facets = {"total": 0, "province": {}, "district": {}, "city": {}}
+    for grouping, province_id, district_id, city_id, count in rows:
+        if grouping == 0b011 and province_id is not None:
+            facets["province"][province_id] = count
+        elif grouping == 0b101 and district_id is not None:
+            facets["district"][district_id] = count
+        elif grouping == 0b110 and city_id is not None:
+            facets["city"][city_id] = count
+        elif grouping == 0b111:
+            facets["total"] = count
+
+    with _facet_lock:
+        if len(_facet_cache) >= FACET_CACHE_SIZE:
+            _facet_cache.clear()
+        _facet_cache[search_query] = (time.monotonic(), facets)
+    return facets
+
+
+# search() reloads its pickles and refits TF-IDF on every call, so its
+# results are kept per query and shared by the listing, prefetch and facet queries
+SEARCH_CACHE_SIZE = 256
+_search_cache = {}  # search_query -> tuple of matched book_ids
+_search_lock = threading.Lock()
 
 
-def load_filtered_books(offset, limit=20, search_query=None, province_id=None, district_id=None, city_id=None):
+def matched_book_ids(search_query):
     """
-    Load books with location and search filters applied.
+    Book IDs matching a search query, running the search once per query.
+
+    Args:
+        search_query (str): Search term
+
+    Returns:
+        tuple: Matching book IDs
+    """
+    with _search_lock:
+        cached = _search_cache.get(search_query)
+    if cached is not None:
+        return cached
+
+    book_ids = tuple(int(book_id) for book_id in search(search_query))
+    with _search_lock:
+        if len(_search_cache) >= SEARCH_CACHE_SIZE:
+            _search_cache.clear()
+        _search_cache[search_query] = book_ids
+    return book_ids
+
+
+def load_filtered_books(cursor=None, limit=20, search_query=None, province_id=None, district_id=None, city_id=None):
+    """
+    Load books with location and search filters applied, newest first.
     
     Args:
-        offset (int): Pagination offset
+        cursor (str): Opaque cursor from the previous page, None for the first page
         limit (int): Number of books to fetch
         search_query (str): Optional search term
         province_id (int): Optional province filter
@@ -54,48 +179,172 @@ def load_filtered_books(offset, limit=20, search_query=None, province_id=None, d
         city_id (int): Optional city filter
     
     Returns:
-        list: List of tuples (ListedBook, Book, User, City)
+        tuple: (list of ListingRow, cursor for the next page or None when
+        there are no more books)
     """
     with get_db() as db:
-        query = (
-            db.query(ListedBook, Book, User, City)
-            .join(Book, ListedBook.book_id == Book.book_id)
-            .join(User, ListedBook.user_id == User.user_id)
-            .join(City, User.city_id == City.city_id)
-            .join(DistrictCity, City.city_id == DistrictCity.city_id)
-            .join(District, DistrictCity.district_id == District.district_id)
-            .join(ProvinceDistrict, District.district_id == ProvinceDistrict.district_id)
-            .join(Province, ProvinceDistrict.province_id == Province.province_id)
-        )
+        # Filter and order on the listing_locations projection, then join the
+        # display columns for the page only
+        query = listing_rows_query(db)
 
         # Apply location filters
-        if city_id:
-            query = query.filter(User.city_id == city_id)
-        elif district_id:
-            query = query.filter(DistrictCity.district_id == district_id)
-        elif province_id:
-            query = query.filter(ProvinceDistrict.province_id == province_id)
+        query = filter_by_location(query, province_id, district_id, city_id)
 
         # Apply search filter if provided
         if search_query:
-            matched_book_ids = search(search_query)
-            query = query.filter(ListedBook.book_id.in_(matched_book_ids))
-        else:
-            query = query.order_by(desc(ListedBook.listed_date))
+            query = query.filter(ListingLocation.book_id.in_(matched_book_ids(search_query)))
+
+        # Keyset pagination: continue strictly after the last row shown
+        if cursor:
+            query = query.filter(after_cursor(ListingLocation.listed_date, ListingLocation.list_id, cursor))
+
+        query = query.order_by(desc(ListingLocation.listed_date), desc(ListingLocation.list_id))
+
+        books = [ListingRow(*row) for row in query.limit(limit).all()]
+        return books, next_cursor(books, limit, key=_listing_cursor_key)
+
+
+# Wall pages prefetched in the background, shared by all sessions. Requests
+# beyond PREFETCH_QUEUE_LIMIT in flight are dropped rather than queued.
+PREFETCH_WORKERS = 4
+PREFETCH_QUEUE_LIMIT = 32
+_prefetch_executor = None
+_prefetch_slots = threading.BoundedSemaphore(PREFETCH_QUEUE_LIMIT)
+_prefetch_lock = threading.Lock()
+
+
+def prefetch_filtered_books(cursor=None, limit=20, **filters):
+    """
+    Start loading a page of load_filtered_books in a background thread.
+
+    Args:
+        cursor (str): Cursor of the page to load
+        limit (int): Number of books to fetch
+        **filters: search_query, province_id, district_id and city_id as for
+            load_filtered_books
+
+    Returns:
+        Future: Resolves to load_filtered_books' (rows, next cursor), or None
+        when the prefetch pool is saturated
+    """
+    global _prefetch_executor
+    if not _prefetch_slots.acquire(blocking=False):
+        return None
+    with _prefetch_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="wall-prefetch")
+    future = _prefetch_executor.submit(load_filtered_books, cursor, limit, **filters)
+    future.add_done_callback(lambda _: _prefetch_slots.release())
+    return future
+
+
+def load_listings_for_books(book_ids, cursor=None, limit=20):
+    """
+    Load listings of the given books, newest first.
+    
+    Args:
+        book_ids (list): Book IDs to include, e.g. a user's recommendations
+        cursor (str): Opaque cursor from the previous page, None for the first page
+        limit (int): Number of listings to fetch
+    
+    Returns:
+        tuple: (list of ListingRow, cursor for the next page or None)
+    """
+    with get_db() as db:
+        query = listing_rows_query(db).filter(ListingLocation.book_id.in_([int(book_id) for book_id in book_ids]))
+        if cursor:
+            query = query.filter(after_cursor(ListingLocation.listed_date, ListingLocation.list_id, cursor))
+        rows = (
+            query
+            .order_by(desc(ListingLocation.listed_date), desc(ListingLocation.list_id))
+            .limit(limit)
+            .all()
+        )
+        listings = [ListingRow(*row) for row in rows]
+        return listings, next_cursor(listings, limit, key=_listing_cursor_key)
+
+
+def iter_listing_batches(province_id=None, district_id=None, city_id=None, book_ids=None,
+                         listed_from=None, listed_until=None, batch_size=1000):
+    """
+    Stream every matching listing in batches through a server-side cursor,
+    keeping memory constant for full scans.
+    
+    Args:
+        province_id (int): Optional province filter
+        district_id (int): Optional district filter
+        city_id (int): Optional city filter
+        book_ids (list): Optional book IDs to include
+        listed_from (datetime): Optional inclusive lower bound on listed_date
+        listed_until (datetime): Optional exclusive upper bound on listed_date
+        batch_size (int): Rows fetched from the database per round trip
+    
+    Yields:
+        list: Up to batch_size ListingRow objects, in list_id order
+    """
+    with get_db() as db:
+        query = filter_by_location(listing_rows_query(db), province_id, district_id, city_id)
+        if book_ids is not None:
+            query = query.filter(ListingLocation.book_id.in_([int(book_id) for book_id in book_ids]))
+        if listed_from is not None:
+            query = query.filter(ListingLocation.listed_date >= listed_from)
+        if listed_until is not None:
+            query = query.filter(ListingLocation.listed_date < listed_until)
+
+        rows = iter(query.order_by(ListingLocation.list_id).yield_per(batch_size))
+        while batch := [ListingRow(*row) for row in itertools.islice(rows, batch_size)]:
+            yield batch
 
-        books = query.offset(offset).limit(limit).all()
-        return books
+
+def iter_listings(**filters):
+    """
+    Stream matching listings one at a time; accepts the same filters as
+    iter_listing_batches.
+    
+    Yields:
+        ListingRow: One listing, in list_id order
+    """
+    for batch in iter_listing_batches(**filters):
+        yield from batch
 
 
 def get_user_location(user_id):
     """Get the user's province, district, and city IDs based on their user_id."""
     with get_db() as db:
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            return None, None, None
-        city_id = user.city_id
-        district_city = db.query(DistrictCity).filter(DistrictCity.city_id == city_id).first()
-        district_id = district_city.district_id if district_city else None
-        province_district = db.query(ProvinceDistrict).filter(ProvinceDistrict.district_id == district_id).first()
-        province_id = province_district.province_id if province_district else None
-        return province_id, district_id, city_id
\ No newline at end of file
+        city_id = db.query(User.city_id).filter(User.user_id == user_id).scalar()
+    if city_id is None:
+        return None, None, None
+    province_id, district_id = get_location_tree().city_parents(city_id)
+    return province_id, district_id, city_id
+
+
+def load_nearby_books(user_id, radius_km=10, limit=20):
+    """
+    Load listed books from cities within radius_km of the user's city,
+    nearest first and newest first within a city.
+    
+    Args:
+        user_id (int): User whose city is the search centre
+        radius_km (float): Search radius in kilometres
+        limit (int): Number of books to fetch
+    
+    Returns:
+        list: List of ListingRow with distance_km set
+    """
+    with get_db() as db:
+        city_id = db.query(User.city_id).filter(User.user_id == user_id).scalar()
+        if city_id is None:
+            return []
+
+        nearby = (
+            values(column("city_id", Integer), column("distance_km", Float), name="nearby_cities")
+            .data(get_location_tree().nearby_cities(city_id, radius_km))
+        )
+        rows = (
+            listing_rows_query(db, nearby.c.distance_km)
+            .join(nearby, nearby.c.city_id == ListingLocation.city_id)
+            .order_by(nearby.c.distance_km, desc(ListingLocation.listed_date), desc(ListingLocation.list_id))
+            .limit(limit)
+            .all()
+        )
+        return [ListingRow(*row) for row in rows]
@@ -0,0 +1,165 @@
+import threading
+import time
+from dataclasses import dataclass
+from functools import cached_property
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+
+from database import get_db
+from models import City, District, DistrictCity, LocationVersion, Province, ProvinceDistrict
+
+# How often a process re-reads location_version to notice hierarchy changes
+VERSION_CHECK_SECONDS = 60
+
+EARTH_RADIUS_KM = 6371.0
+
+
+@dataclass(frozen=True)
+class LocationTree:
+    """Immutable province -> district -> city hierarchy with parent lookups."""
+    version: int
+    province_names: Mapping[int, str]
+    district_names: Mapping[int, str]
+    city_names: Mapping[int, str]
+    province_districts: Mapping[int, Tuple[int, ...]]  # Children sorted by name
+    district_cities: Mapping[int, Tuple[int, ...]]
+    district_province: Mapping[int, int]
+    city_district: Mapping[int, int]
+    city_ids_by_name: Mapping[str, int]
+    city_coordinates: Mapping[int, Tuple[float, float]]  # city_id -> (latitude, longitude)
+
+    def provinces(self):
+        """Return {province name: province_id} sorted by name."""
+        return {self.province_names[pid]: pid for pid in _sorted_by_name(self.province_names, self.province_names)}
+
+    def districts(self, province_id=None):
+        """Return {district name: district_id} sorted by name, optionally within a province."""
+        if province_id:
+            district_ids = self.province_districts.get(province_id, ())
+        else:
+            district_ids = _sorted_by_name(self.district_province, self.district_names)
+        return {self.district_names[did]: did for did in district_ids}
+
+    def cities(self, district_id=None):
+        """Return {city name: city_id} sorted by name, optionally within a district."""
+        if district_id:
+            city_ids = self.district_cities.get(district_id, ())
+        else:
+            city_ids = _sorted_by_name(self.city_district, self.city_names)
+        return {self.city_names[cid]: cid for cid in city_ids}
+
+    def city_parents(self, city_id) -> Tuple[Optional[int], Optional[int]]:
+        """Return (province_id, district_id) for a city."""
+        district_id = self.city_district.get(city_id)
+        return self.district_province.get(district_id), district_id
+
+    def nearby_cities(self, city_id, radius_km):
+        """
+        Find cities within radius_km of a city by great-circle distance.
+
+        Args:
+            city_id (int): City to search around
+            radius_km (float): Search radius in kilometres
+
+        Returns:
+            list: (city_id, distance_km) tuples ordered by distance, starting
+            with the city itself. Cities without coordinates only match themselves.
+        """
+        origin = self.city_coordinates.get(city_id)
+        if origin is None or self._city_index is None:
+            return [(city_id, 0.0)]
+
+        import numpy as np
+
+        index, city_ids = self._city_index
+        matches, distances = index.query_radius(
+            np.radians([origin]), r=radius_km / EARTH_RADIUS_KM, return_distance=True, sort_results=True
+        )
+        return [
+            (city_ids[match], float(distance) * EARTH_RADIUS_KM)
+            for match, distance in zip(matches[0], distances[0])
+        ]
+
+    @cached_property
+    def _city_index(self):
+        """Ball tree over city coordinates (haversine metric), built on first use."""
+        if not self.city_coordinates:
+            return None
+
+        import numpy as np
+        from sklearn.neighbors import BallTree
+
+        city_ids = list(self.city_coordinates)
+        points = np.radians([self.city_coordinates[cid] for cid in city_ids])
+        return BallTree(points, metric="haversine"), city_ids
+
+
+def _sorted_by_name(ids, names):
+    return sorted(ids, key=lambda location_id: names[location_id])
+
+
+def _load_tree(db, version):
+    province_names = dict(db.query(Province.province_id, Province.name).all())
+    district_names = dict(db.query(District.district_id, District.name).all())
+    city_names, city_coordinates = {}, {}
+    for city_id, name, latitude, longitude in db.query(City.city_id, City.name, City.latitude, City.longitude):
+        city_names[city_id] = name
+        if latitude is not None and longitude is not None:
+            city_coordinates[city_id] = (latitude, longitude)
+
+    province_districts, district_province = {}, {}
+    for province_id, district_id in db.query(ProvinceDistrict.province_id, ProvinceDistrict.district_id):
+        province_districts.setdefault(province_id, []).append(district_id)
+        district_province.setdefault(district_id, province_id)
+
+    district_cities, city_district = {}, {}
+    for district_id, city_id in db.query(DistrictCity.district_id, DistrictCity.city_id):
+        district_cities.setdefault(district_id, []).append(city_id)
+        city_district.setdefault(city_id, district_id)
+
+    return LocationTree(
+        version=version,
+        province_names=MappingProxyType(province_names),
+        district_names=MappingProxyType(district_names),
+        city_names=MappingProxyType(city_names),
+        province_districts=MappingProxyType({
+            pid: tuple(_sorted_by_name(dids, district_names)) for pid, dids in province_districts.items()
+        }),
+        district_cities=MappingProxyType({
+            did: tuple(_sorted_by_name(cids, city_names)) for did, cids in district_cities.items()
+        }),
+        district_province=MappingProxyType(district_province),
+        city_district=MappingProxyType(city_district),
+        city_ids_by_name=MappingProxyType({name: cid for cid, name in city_names.items()}),
+        city_coordinates=MappingProxyType(city_coordinates),
+    )
+
+
+_tree = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_location_tree():
+    """
+    Return the process-wide location tree, loading it on first use and
+    reloading it when location_version has been bumped.
+    """
+    global _tree, _checked_at
+    if _tree is not None and time.monotonic() - _checked_at < VERSION_CHECK_SECONDS:
+        return _tree
+    with _lock:
+        if _tree is None or time.monotonic() - _checked_at >= VERSION_CHECK_SECONDS:
+            with get_db() as db:
+                version = db.query(LocationVersion.version).filter(LocationVersion.version_id == 1).scalar() or 0
+                if _tree is None or _tree.version != version:
+                    _tree = _load_tree(db, version)
+            _checked_at = time.monotonic()
+        return _tree
+
+
+def refresh_location_tree():
+    """Force the next get_location_tree() call to check location_version."""
+    global _checked_at
+    with _lock:
+        _checked_at = 0.0
@@ -1,92 +1,343 @@
-from datetime import datetime
+from datetime import date, datetime
 
+from sqlalchemy import case, func, literal_column, select, text, union_all, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
 from database import get_db
-from models import Conversation, Message, User
+from models import MESSAGE_SEARCH_CONFIG, Conversation, Message, User, engine, message_search_document
+from notifications import user_channel
+from pagination import after_cursor, from_cursor, next_cursor
 
 
 def get_or_create_conversation(db: Session, user1_id: int, user2_id: int):
-    """Get an existing conversation between two users or create a new one."""
-    conversation = (
-        db.query(Conversation)
-        .filter(
-            ((Conversation.user1_id == user1_id) & (Conversation.user2_id == user2_id)) |
-            ((Conversation.user1_id == user2_id) & (Conversation.user2_id == user1_id))
-        )
-        .first()
+    """
+    Get an existing conversation between two users or create a new one.
+
+    Conversations are keyed by the ordered (low_user_id, high_user_id) pair,
+    so the lookup is a single unique-index probe and concurrent creations
+    for the same pair resolve to one row.
+    """
+    low_user_id, high_user_id = sorted((user1_id, user2_id))
+    pair = db.query(Conversation).filter(
+        Conversation.low_user_id == low_user_id,
+        Conversation.high_user_id == high_user_id
     )
+    conversation = pair.first()
     if not conversation:
-        conversation = Conversation(user1_id=user1_id, user2_id=user2_id)
-        db.add(conversation)
+        conversation_id = db.execute(
+            insert(Conversation)
+            .values(user1_id=user1_id, user2_id=user2_id)
+            .on_conflict_do_nothing(index_elements=[Conversation.low_user_id, Conversation.high_user_id])
+            .returning(Conversation.conversation_id)
+        ).scalar()
         db.commit()
-        db.refresh(conversation)
+        # No row returned means a concurrent request created the pair first
+        conversation = db.get(Conversation, conversation_id) if conversation_id else pair.one()
     return conversation
 
 
+# Months whose partitions this process has already ensured
+_partitioned_months = set()
+
+
+def ensure_message_partitions(sent_at: datetime):
+    """
+    Make sure the messages partitions for sent_at's month and the next one
+    exist. Runs in its own short transaction at most once per process and
+    month; if it fails the message still lands in messages_default.
+    """
+    month = date(sent_at.year, sent_at.month, 1)
+    if month in _partitioned_months:
+        return
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("SELECT ensure_message_partitions(:month)"), {"month": month})
+    except SQLAlchemyError as e:
+        print(f"Could not create message partitions for {month:%Y-%m}: {e}")
+        return
+    _partitioned_months.add(month)
+
+
+def archive_old_messages(months_to_keep: int = 12):
+    """
+    Fold monthly message partitions older than months_to_keep into the
+    compressed messages_archive partition. Archived messages remain readable.
+
+    Returns:
+        int: Number of monthly partitions archived
+    """
+    today = datetime.utcnow()
+    months = today.year * 12 + today.month - 1 - months_to_keep
+    cutoff = date(months // 12, months % 12 + 1, 1)
+    with engine.begin() as connection:
+        return connection.execute(text("SELECT archive_message_partitions(:cutoff)"), {"cutoff": cutoff}).scalar()
+
+
 def send_message(db: Session, sender_id: int, receiver_id: int, content: str):
     """Send a message between two users, creating a conversation if needed."""
     conversation = get_or_create_conversation(db, sender_id, receiver_id)
+    sent_at = datetime.utcnow()
+    ensure_message_partitions(sent_at)
     message = Message(
         conversation_id=conversation.conversation_id,
         sender_id=sender_id,
         content=content,
+        sent_at=sent_at,
     )
     db.add(message)
+    db.flush()
+
+    # Update the inbox summary in the same transaction; the counters are
+    # incremented in SQL so concurrent senders never lose an update
+    is_latest = (Conversation.last_message_at == None) | (Conversation.last_message_at <= message.sent_at)
+    db.execute(
+        update(Conversation)
+        .where(Conversation.conversation_id == conversation.conversation_id)
+        .values(
+            last_message_id=case((is_latest, message.message_id), else_=Conversation.last_message_id),
+            last_message_at=func.greatest(Conversation.last_message_at, message.sent_at),
+            user1_unread=Conversation.user1_unread + case((Conversation.user1_id != sender_id, 1), else_=0),
+            user2_unread=Conversation.user2_unread + case((Conversation.user2_id != sender_id, 1), else_=0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    # Delivered to the receiver's listeners only once the transaction commits
+    db.execute(select(func.pg_notify(user_channel(receiver_id), str(conversation.conversation_id))))
     db.commit()
     db.refresh(message)
     return message
 
 
-def get_user_conversations(db: Session, user_id: int):
-    """Fetch all conversations for a user with the latest message preview."""
-    conversations = (
-        db.query(Conversation)
-        .filter((Conversation.user1_id == user_id) | (Conversation.user2_id == user_id))
-        .all()
+def mark_conversation_read(db: Session, conversation_id: int, user_id: int):
+    """
+    Mark the other participant's messages as read with a single UPDATE.
+
+    The user's unread counter is zeroed first, which locks the conversation
+    row so a message sent meanwhile stays counted as unread. Nothing is
+    written when the counter is already zero.
+    """
+    reset = db.execute(
+        update(Conversation)
+        .where(
+            Conversation.conversation_id == conversation_id,
+            ((Conversation.user1_id == user_id) & (Conversation.user1_unread > 0)) |
+            ((Conversation.user2_id == user_id) & (Conversation.user2_unread > 0))
+        )
+        .values(
+            user1_unread=case((Conversation.user1_id == user_id, 0), else_=Conversation.user1_unread),
+            user2_unread=case((Conversation.user2_id == user_id, 0), else_=Conversation.user2_unread),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if reset.rowcount:
+        db.query(Message).filter(
+            Message.conversation_id == conversation_id,
+            Message.sender_id != user_id,
+            Message.is_read == False
+        ).update({Message.is_read: True}, synchronize_session=False)
+    db.commit()
+
+
+def _inbox_query(db: Session, user_id: int, conversation_id: int = None):
+    """
+    Query the user's conversations from the summary columns. Each branch of
+    the UNION ALL is an index scan on (participant, last_message_at DESC).
+    """
+    as_user1 = (
+        select(
+            Conversation.conversation_id,
+            Conversation.user2_id.label("other_user_id"),
+            Conversation.user1_unread.label("unread_count"),
+            Conversation.last_message_id,
+            Conversation.last_message_at,
+        )
+        .where(Conversation.user1_id == user_id)
     )
-    result = []
-    for conv in conversations:
-        latest_message = (
-            db.query(Message)
-            .filter(Message.conversation_id == conv.conversation_id)
-            .order_by(Message.sent_at.desc())
-            .first()
+    as_user2 = (
+        select(
+            Conversation.conversation_id,
+            Conversation.user1_id.label("other_user_id"),
+            Conversation.user2_unread.label("unread_count"),
+            Conversation.last_message_id,
+            Conversation.last_message_at,
         )
-        other_user_id = conv.user2_id if conv.user1_id == user_id else conv.user1_id
-        other_user = db.query(User).filter(User.user_id == other_user_id).first()
-        result.append({
-            "conversation_id": conv.conversation_id,
-            "other_user_id": other_user_id,  # Add this
-            "other_user": other_user.user_name,
-            "latest_message": latest_message.content if latest_message else "No messages yet",
-            "latest_message_time": latest_message.sent_at if latest_message else conv.created_at,
-            "unread_count": db.query(Message).filter(
-                Message.conversation_id == conv.conversation_id,
-                Message.sender_id != user_id,
-                Message.is_read == False
-            ).count()
-        })
-    return sorted(result, key=lambda x: x["latest_message_time"], reverse=True)
-
-
-def get_conversation_messages(db: Session, conversation_id: int, user_id: int):
-    """Fetch all messages in a conversation and mark unread messages as read."""
-    messages = (
-        db.query(Message)
-        .filter(Message.conversation_id == conversation_id)
-        .order_by(Message.sent_at.asc())
+        .where(Conversation.user2_id == user_id, Conversation.user1_id != user_id)
+    )
+    if conversation_id is not None:
+        as_user1 = as_user1.where(Conversation.conversation_id == conversation_id)
+        as_user2 = as_user2.where(Conversation.conversation_id == conversation_id)
+    inbox = union_all(as_user1, as_user2).subquery("inbox")
+
+    return (
+        db.query(
+            inbox.c.conversation_id,
+            inbox.c.other_user_id,
+            User.user_name,
+            Message.content,
+            inbox.c.last_message_at,
+            inbox.c.unread_count,
+        )
+        .select_from(inbox)
+        .join(User, User.user_id == inbox.c.other_user_id)
+        # last_message_at is the latest message's sent_at, so each probe hits one partition
+        .outerjoin(Message, (Message.message_id == inbox.c.last_message_id) &
+                   (Message.sent_at == inbox.c.last_message_at))
+        .order_by(inbox.c.last_message_at.desc(), inbox.c.conversation_id.desc())
+    )
+
+
+def _inbox_entry(row):
+    conversation_id, other_user_id, other_user_name, content, sent_at, unread_count = row
+    return {
+        "conversation_id": conversation_id,
+        "other_user_id": other_user_id,
+        "other_user": other_user_name,
+        "latest_message": content if content is not None else "No messages yet",
+        "latest_message_time": sent_at,
+        "unread_count": unread_count,
+    }
+
+
+def get_user_conversations(db: Session, user_id: int, limit: int = 50, offset: int = 0):
+    """
+    Fetch a page of the user's conversations with the latest message preview
+    and unread count, newest activity first, in a single query.
+    """
+    rows = _inbox_query(db, user_id).offset(offset).limit(limit).all()
+    return [_inbox_entry(row) for row in rows]
+
+
+def get_conversation_summary(db: Session, user_id: int, conversation_id: int):
+    """Fetch one inbox entry, e.g. for a selected conversation outside the current page."""
+    row = _inbox_query(db, user_id, conversation_id).first()
+    return _inbox_entry(row) if row else None
+
+
+def get_conversation_messages(db: Session, conversation_id: int, user_id: int,
+                              limit: int = 50, before: str = None, since: str = None):
+    """
+    Fetch a page of a conversation's history, oldest first.
+
+    Without a cursor this returns the latest `limit` messages and marks the
+    conversation as read. `before` (a cursor returned by a previous call)
+    loads the `limit` messages older than it; `since` loads every message
+    from that cursor onwards, for keeping a view that already shows older
+    pages up to date.
+
+    Returns:
+        tuple: (list of message dicts, cursor for older messages or None)
+    """
+    if before is None:
+        mark_conversation_read(db, conversation_id, user_id)
+
+    # Both participants' names in one query instead of one per message
+    sender_names = dict(
+        db.query(User.user_id, User.user_name)
+        .join(Conversation, (Conversation.user1_id == User.user_id) | (Conversation.user2_id == User.user_id))
+        .filter(Conversation.conversation_id == conversation_id)
         .all()
     )
-    # Mark unread messages from the other user as read
-    for msg in messages:
-        if msg.sender_id != user_id and not msg.is_read:
-            msg.is_read = True
-    db.commit()
+
+    query = db.query(Message.message_id, Message.sender_id, Message.content, Message.sent_at).filter(
+        Message.conversation_id == conversation_id
+    )
+    if since:
+        messages = query.filter(from_cursor(Message.sent_at, Message.message_id, since))
+        messages = messages.order_by(Message.sent_at.asc(), Message.message_id.asc()).all()
+        older = None
+    else:
+        if before:
+            query = query.filter(after_cursor(Message.sent_at, Message.message_id, before))
+        messages = query.order_by(Message.sent_at.desc(), Message.message_id.desc()).limit(limit).all()
+        older = next_cursor(messages, limit, key=lambda msg: (msg.sent_at, msg.message_id))
+        messages.reverse()
+
     return [
-        {"sender": db.query(User).filter(User.user_id == msg.sender_id).first().user_name,
+        {"sender": sender_names.get(msg.sender_id),
          "content": msg.content,
          "sent_at": msg.sent_at,
          "is_sent_by_user": msg.sender_id == user_id}
         for msg in messages
-    ]
\ No newline at end of file
+    ], older
+
+
+def search_messages(db: Session, user_id: int, query: str, limit: int = 20, offset: int = 0):
+    """
+    Full-text search over the messages in the user's conversations.
+
+    The query accepts web-search syntax ("quoted phrases", or, -excluded)
+    and is matched through the GIN index on message content; snippets are
+    only generated for the returned page.
+
+    Args:
+        db (Session): Database session
+        user_id (int): User whose conversations to search
+        query (str): Search text
+        limit (int): Maximum number of results to return
+        offset (int): Number of results to skip
+
+    Returns:
+        list: Dicts with message_id, conversation_id, other_user, sender,
+        snippet and sent_at, best match first
+    """
+    config = literal_column(f"'{MESSAGE_SEARCH_CONFIG}'")
+    ts_query = func.websearch_to_tsquery(config, query)
+    document = message_search_document(Message.content)
+
+    own = union_all(
+        select(Conversation.conversation_id, Conversation.user2_id.label("other_user_id"))
+        .where(Conversation.user1_id == user_id),
+        select(Conversation.conversation_id, Conversation.user1_id.label("other_user_id"))
+        .where(Conversation.user2_id == user_id, Conversation.user1_id != user_id),
+    ).subquery("own")
+
+    rank = func.ts_rank(document, ts_query).label("rank")
+    matches = (
+        select(
+            Message.message_id,
+            Message.conversation_id,
+            Message.sender_id,
+            Message.content,
+            Message.sent_at,
+            own.c.other_user_id,
+            rank,
+        )
+        .join(own, own.c.conversation_id == Message.conversation_id)
+        .where(document.op("@@")(ts_query))
+        .order_by(rank.desc(), Message.sent_at.desc(), Message.message_id.desc())
+        .limit(limit)
+        .offset(offset)
+        .subquery("matches")
+    )
+
+    other_user = User.__table__.alias("other_user")
+    sender = User.__table__.alias("sender")
+    snippet = func.ts_headline(
+        config, matches.c.content, ts_query,
+        "MaxFragments=2, MaxWords=20, MinWords=5, StartSel=**, StopSel=**"
+    )
+    rows = db.execute(
+        select(
+            matches.c.message_id,
+            matches.c.conversation_id,
+            other_user.c.user_name,
+            sender.c.user_name,
+            snippet,
+            matches.c.sent_at,
+        )
+        .join(other_user, other_user.c.user_id == matches.c.other_user_id)
+        .join(sender, sender.c.user_id == matches.c.sender_id)
+        .order_by(matches.c.rank.desc(), matches.c.sent_at.desc(), matches.c.message_id.desc())
+    ).all()
+
+    return [
+        {"message_id": message_id,
+         "conversation_id": conversation_id,
+         "other_user": other_user_name,
+         "sender": sender_name,
+         "snippet": snippet_text,
+         "sent_at": sent_at}
+        for message_id, conversation_id, other_user_name, sender_name, snippet_text, sent_at in rows
+    ]
@@ -5,16 +5,22 @@ from datetime import datetime
 from dotenv import load_dotenv
 from sqlalchemy import (
     ARRAY,
+    BigInteger,
     Boolean,
     Column,
+    Computed,
     Date,
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
+    Sequence,
     String,
     Text,
     create_engine,
+    func,
+    literal_column,
     text,
 )
 from sqlalchemy.ext.declarative import declarative_base
@@ -28,86 +34,155 @@ engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Running rating aggregates: a single global stats row plus per-book sum/count
+# columns, so the Bayesian trigger can adjust them by deltas instead of
+# re-aggregating user_book_ratings on every write.
+RATING_AGGREGATES_SETUP = """
+CREATE TABLE IF NOT EXISTS rating_stats (
+    stats_id INTEGER PRIMARY KEY,
+    rating_sum BIGINT NOT NULL DEFAULT 0,
+    rating_count BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION rebuild_rating_aggregates()
+RETURNS VOID AS $$
+DECLARE
+    global_avg FLOAT := 0.0;
+    m CONSTANT INTEGER := 5;
+BEGIN
+    INSERT INTO rating_stats (stats_id, rating_sum, rating_count)
+    SELECT 1, COALESCE(SUM(rating), 0), COUNT(rating)
+    FROM user_book_ratings
+    ON CONFLICT (stats_id) DO UPDATE
+    SET rating_sum = EXCLUDED.rating_sum,
+        rating_count = EXCLUDED.rating_count;
+
+    SELECT COALESCE(rating_sum::FLOAT / NULLIF(rating_count, 0), 0.0)
+    INTO global_avg
+    FROM rating_stats
+    WHERE stats_id = 1;
+
+    -- Only rows whose aggregates change are rewritten
+    UPDATE books b
+    SET rating_sum = target.sum_ratings,
+        rating_count = target.count_ratings,
+        average_rating = target.average_rating
+    FROM (
+        SELECT bk.book_id,
+               COALESCE(agg.sum_ratings, 0) AS sum_ratings,
+               COALESCE(agg.count_ratings, 0) AS count_ratings,
+               CASE
+                   WHEN agg.count_ratings > 0 THEN
+                       ((m * global_avg) + agg.sum_ratings) / (m + agg.count_ratings)
+                   ELSE
+                       0.0
+                   END AS average_rating
+        FROM books bk
+        LEFT JOIN (
+            SELECT book_id, SUM(rating) AS sum_ratings, COUNT(rating) AS count_ratings
+            FROM user_book_ratings
+            GROUP BY book_id
+        ) agg ON agg.book_id = bk.book_id
+    ) target
+    WHERE b.book_id = target.book_id
+      AND (b.rating_sum, b.rating_count, b.average_rating)
+          IS DISTINCT FROM (target.sum_ratings, target.count_ratings, target.average_rating);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Older databases store the rating sum in rating_count; add the running sum
+-- column and rebuild both from user_book_ratings exactly once.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'books' AND column_name = 'rating_sum'
+    ) THEN
+        ALTER TABLE books ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0;
+        PERFORM rebuild_rating_aggregates();
+    ELSIF NOT EXISTS (SELECT 1 FROM rating_stats WHERE stats_id = 1) THEN
+        PERFORM rebuild_rating_aggregates();
+    END IF;
+END;
+$$;
+"""
+
 # Bayesian Rating Trigger Function
 BAYESIAN_TRIGGER_FUNCTION = """
 CREATE OR REPLACE FUNCTION update_bayesian_rating()
 RETURNS TRIGGER AS $$
 DECLARE
+    old_sum INTEGER := 0;
+    old_count INTEGER := 0;
+    new_sum INTEGER := 0;
+    new_count INTEGER := 0;
+    global_sum BIGINT;
+    global_count BIGINT;
     global_avg FLOAT := 0.0;
-    total_ratings INTEGER := 0;
-    sum_ratings INTEGER := 0;
     m CONSTANT INTEGER := 5;
 BEGIN
-    -- Calculate global average for Bayesian formula
-    SELECT AVG(rating), SUM(rating)
-    INTO global_avg, total_ratings
-    FROM user_book_ratings
-    WHERE rating IS NOT NULL;
+    -- Bulk loads skip per-row maintenance; the statement-level trigger
+    -- recomputes the affected books once per INSERT statement instead
+    -- ('on'), or the loader calls rebuild_rating_aggregates() once at the
+    -- end ('deferred').
+    IF TG_OP = 'INSERT' AND current_setting('booxchange.bulk_ratings', true) IN ('on', 'deferred') THEN
+        RETURN NULL;
+    END IF;
 
-    IF global_avg IS NULL THEN
-        global_avg := 0.0;
+    -- Contribution of the row before and after the change
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.rating IS NOT NULL THEN
+        old_sum := OLD.rating;
+        old_count := 1;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.rating IS NOT NULL THEN
+        new_sum := NEW.rating;
+        new_count := 1;
     END IF;
 
-    -- INSERT: Add new rating to sum
-    IF TG_OP = 'INSERT' THEN
-        SELECT SUM(rating)
-        INTO sum_ratings
-        FROM user_book_ratings
-        WHERE book_id = NEW.book_id;
+    IF TG_OP = 'UPDATE' AND OLD.book_id = NEW.book_id
+       AND old_sum = new_sum AND old_count = new_count THEN
+        RETURN NULL;
+    END IF;
 
+    -- Adjust the global running totals and derive the prior mean from them
+    UPDATE rating_stats
+    SET rating_sum = rating_sum + new_sum - old_sum,
+        rating_count = rating_count + new_count - old_count
+    WHERE stats_id = 1
+    RETURNING rating_sum, rating_count INTO global_sum, global_count;
+
+    IF global_count > 0 THEN
+        global_avg := global_sum::FLOAT / global_count;
+    END IF;
+
+    -- Remove the old contribution (also covers a rating moved to another book)
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.book_id <> NEW.book_id) THEN
         UPDATE books
-        SET rating_count = COALESCE(sum_ratings, 0),
+        SET rating_sum = rating_sum - old_sum,
+            rating_count = COALESCE(rating_count, 0) - old_count,
             average_rating = CASE
-                WHEN sum_ratings > 0 THEN
-                    ((m * global_avg) + COALESCE(sum_ratings, 0)) / (m + (SELECT COUNT(*) FROM user_book_ratings WHERE book_id = NEW.book_id))
+                WHEN COALESCE(rating_count, 0) - old_count > 0 THEN
+                    ((m * global_avg) + rating_sum - old_sum) / (m + COALESCE(rating_count, 0) - old_count)
                 ELSE
                     0.0
                 END
-        WHERE book_id = NEW.book_id;
-
-        RAISE NOTICE 'INSERT: Book %, Rating Count = %, Avg = %', NEW.book_id, COALESCE(sum_ratings, 0), (SELECT average_rating FROM books WHERE book_id = NEW.book_id);
-
-    -- UPDATE: Adjust rating_count by the difference
-    ELSIF TG_OP = 'UPDATE' THEN
-        IF NEW.rating != OLD.rating THEN
-            SELECT SUM(rating)
-            INTO sum_ratings
-            FROM user_book_ratings
-            WHERE book_id = NEW.book_id;
-
-            UPDATE books
-            SET rating_count = COALESCE(sum_ratings, 0),
-                average_rating = CASE
-                    WHEN sum_ratings > 0 THEN
-                        ((m * global_avg) + COALESCE(sum_ratings, 0)) / (m + (SELECT COUNT(*) FROM user_book_ratings WHERE book_id = NEW.book_id))
-                    ELSE
-                        0.0
-                    END
-            WHERE book_id = NEW.book_id;
-
-            RAISE NOTICE 'UPDATE: Book %, Old Rating = %, New Rating = %, Rating Count = %, Avg = %', 
-                         NEW.book_id, OLD.rating, NEW.rating, COALESCE(sum_ratings, 0), (SELECT average_rating FROM books WHERE book_id = NEW.book_id);
-        END IF;
-
-    -- DELETE: Subtract removed rating from sum
-    ELSIF TG_OP = 'DELETE' THEN
-        SELECT SUM(rating)
-        INTO sum_ratings
-        FROM user_book_ratings
         WHERE book_id = OLD.book_id;
+        old_sum := 0;
+        old_count := 0;
+    END IF;
 
+    -- Add the new contribution, net of the old one when the book is unchanged
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
         UPDATE books
-        SET rating_count = COALESCE(sum_ratings, 0),
+        SET rating_sum = rating_sum + new_sum - old_sum,
+            rating_count = COALESCE(rating_count, 0) + new_count - old_count,
             average_rating = CASE
-                WHEN sum_ratings > 0 THEN
-                    ((m * global_avg) + COALESCE(sum_ratings, 0)) / (m + (SELECT COUNT(*) FROM user_book_ratings WHERE book_id = OLD.book_id))
+                WHEN COALESCE(rating_count, 0) + new_count - old_count > 0 THEN
+                    ((m * global_avg) + rating_sum + new_sum - old_sum) / (m + COALESCE(rating_count, 0) + new_count - old_count)
                 ELSE
                     0.0
                 END
-        WHERE book_id = OLD.book_id;
-
-        RAISE NOTICE 'DELETE: Book %, Removed Rating = %, Rating Count = %, Avg = %', 
-                     OLD.book_id, OLD.rating, COALESCE(sum_ratings, 0), (SELECT average_rating FROM books WHERE book_id = OLD.book_id);
+        WHERE book_id = NEW.book_id;
     END IF;
 
     RETURN NULL;
@@ -121,16 +196,573 @@ AFTER INSERT OR UPDATE OR DELETE ON user_book_ratings
 FOR EACH ROW EXECUTE FUNCTION update_bayesian_rating();
 """
 
+# Statement-level counterpart used while booxchange.bulk_ratings is on: one
+# set-based recomputation over the books touched by each INSERT statement.
+BULK_RATING_TRIGGER_FUNCTION = """
+CREATE INDEX IF NOT EXISTS ix_user_book_ratings_book_id ON user_book_ratings (book_id);
+
+CREATE OR REPLACE FUNCTION update_bayesian_rating_bulk()
+RETURNS TRIGGER AS $$
+DECLARE
+    global_sum BIGINT;
+    global_count BIGINT;
+    global_avg FLOAT := 0.0;
+    m CONSTANT INTEGER := 5;
+BEGIN
+    IF current_setting('booxchange.bulk_ratings', true) IS DISTINCT FROM 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE rating_stats
+    SET rating_sum = rating_sum + batch.sum_ratings,
+        rating_count = rating_count + batch.count_ratings
+    FROM (
+        SELECT COALESCE(SUM(rating), 0) AS sum_ratings, COUNT(rating) AS count_ratings
+        FROM new_ratings
+    ) batch
+    WHERE stats_id = 1
+    RETURNING rating_stats.rating_sum, rating_stats.rating_count INTO global_sum, global_count;
+
+    IF global_count > 0 THEN
+        global_avg := global_sum::FLOAT / global_count;
+    END IF;
+
+    UPDATE books b
+    SET rating_sum = agg.sum_ratings,
+        rating_count = agg.count_ratings,
+        average_rating = CASE
+            WHEN agg.count_ratings > 0 THEN
+                ((m * global_avg) + agg.sum_ratings) / (m + agg.count_ratings)
+            ELSE
+                0.0
+            END
+    FROM (
+        SELECT r.book_id, COALESCE(SUM(r.rating), 0) AS sum_ratings, COUNT(r.rating) AS count_ratings
+        FROM user_book_ratings r
+        WHERE r.book_id IN (SELECT DISTINCT book_id FROM new_ratings)
+        GROUP BY r.book_id
+    ) agg
+    WHERE b.book_id = agg.book_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_update_bayesian_rating_bulk ON user_book_ratings;
+CREATE TRIGGER trigger_update_bayesian_rating_bulk
+AFTER INSERT ON user_book_ratings
+REFERENCING NEW TABLE AS new_ratings
+FOR EACH STATEMENT EXECUTE FUNCTION update_bayesian_rating_bulk();
+"""
+
+# Setting that switches user_book_ratings inserts to the statement-level trigger
+BULK_RATINGS_SETTING = "booxchange.bulk_ratings"
+
+# Text search configuration for message content
+MESSAGE_SEARCH_CONFIG = "english"
+
+
+def message_search_document(content):
+    """tsvector of a message's content; queries must use this exact expression to hit its GIN index."""
+    return func.to_tsvector(literal_column(f"'{MESSAGE_SEARCH_CONFIG}'"), content)
+
+# ID sequences: rows get their keys from nextval() instead of SELECT max()+1
+USER_ID_SEQUENCE = Sequence("users_user_id_seq")
+BOOK_ID_SEQUENCE = Sequence("books_book_id_seq")
+LIST_ID_SEQUENCE = Sequence("listed_books_list_id_seq")
+MESSAGE_ID_SEQUENCE = Sequence("messages_message_id_seq")
+
+# Attach each sequence to its key column and move it past ids that were
+# inserted explicitly (CSV imports, the old max()+1 allocation). Sequences
+# only ever move forward so concurrent nextval() callers never collide.
+ID_SEQUENCES_SETUP = """
+CREATE OR REPLACE FUNCTION sync_id_sequence(table_name TEXT, column_name TEXT, sequence_name TEXT)
+RETURNS VOID AS $$
+DECLARE
+    max_id BIGINT;
+    last_id BIGINT;
+BEGIN
+    EXECUTE format('CREATE SEQUENCE IF NOT EXISTS %I OWNED BY %I.%I', sequence_name, table_name, column_name);
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN %I SET DEFAULT nextval(%L)', table_name, column_name, sequence_name);
+    EXECUTE format('SELECT MAX(%I) FROM %I', column_name, table_name) INTO max_id;
+    EXECUTE format('SELECT last_value FROM %I', sequence_name) INTO last_id;
+    IF max_id IS NOT NULL AND max_id >= last_id THEN
+        PERFORM setval(sequence_name, max_id);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT sync_id_sequence('users', 'user_id', 'users_user_id_seq');
+SELECT sync_id_sequence('books', 'book_id', 'books_book_id_seq');
+SELECT sync_id_sequence('listed_books', 'list_id', 'listed_books_list_id_seq');
+"""
+
+# One listing per (user, book): the unique index is the conflict target for
+# bulk upserts. Duplicates left by the old code path keep their latest list_id.
+LISTED_BOOKS_SETUP = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE tablename = 'listed_books' AND indexname = 'uq_listed_books_user_book'
+    ) THEN
+        DELETE FROM listed_books a
+        USING listed_books b
+        WHERE a.user_id = b.user_id AND a.book_id = b.book_id AND a.list_id < b.list_id;
+
+        CREATE UNIQUE INDEX uq_listed_books_user_book ON listed_books (user_id, book_id);
+    END IF;
+END;
+$$;
+"""
+
+# Location hierarchy version: bumped by any write to the location tables so
+# processes holding the in-memory location tree know when to reload it.
+LOCATION_VERSION_SETUP = """
+CREATE TABLE IF NOT EXISTS location_version (
+    version_id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1
+);
+INSERT INTO location_version (version_id, version) VALUES (1, 1)
+ON CONFLICT (version_id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_location_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE location_version SET version = version + 1 WHERE version_id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    location_table TEXT;
+BEGIN
+    FOREACH location_table IN ARRAY ARRAY['province', 'district', 'city', 'province_district', 'district_city'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trigger_bump_location_version ON %I', location_table);
+        EXECUTE format(
+            'CREATE TRIGGER trigger_bump_location_version '
+            'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION bump_location_version()',
+            location_table
+        );
+    END LOOP;
+END;
+$$;
+"""
+
+# City coordinates for "books near me"; cities without them only match
+# listings in the same city
+CITY_COORDINATES_SETUP = """
+ALTER TABLE city ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION;
+ALTER TABLE city ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+"""
+
+# Listing location projection: one row per listing carrying its city,
+# district and province so the wall filters with a single index range scan.
+# Kept in sync by triggers on listed_books and on users.city_id.
+LISTING_LOCATIONS_SETUP = """
+CREATE TABLE IF NOT EXISTS listing_locations (
+    list_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    city_id INTEGER,
+    district_id INTEGER,
+    province_id INTEGER,
+    listed_date TIMESTAMP
+);
+-- list_id mirrors listed_books.list_id; drop the SERIAL default older
+-- create_all runs gave it
+ALTER TABLE listing_locations ALTER COLUMN list_id DROP DEFAULT;
+DROP SEQUENCE IF EXISTS listing_locations_list_id_seq;
+CREATE INDEX IF NOT EXISTS ix_listing_locations_recent ON listing_locations (listed_date DESC, list_id DESC);
+CREATE INDEX IF NOT EXISTS ix_listing_locations_city ON listing_locations (city_id, listed_date DESC, list_id DESC);
+CREATE INDEX IF NOT EXISTS ix_listing_locations_district ON listing_locations (district_id, listed_date DESC, list_id DESC);
+CREATE INDEX IF NOT EXISTS ix_listing_locations_province ON listing_locations (province_id, listed_date DESC, list_id DESC);
+CREATE INDEX IF NOT EXISTS ix_listing_locations_book_id ON listing_locations (book_id);
+CREATE INDEX IF NOT EXISTS ix_listing_locations_user_id ON listing_locations (user_id);
+
+CREATE OR REPLACE VIEW listing_location_source AS
+SELECT lb.list_id, lb.user_id, lb.book_id, u.city_id,
+       (SELECT MIN(dc.district_id) FROM district_city dc WHERE dc.city_id = u.city_id) AS district_id,
+       (SELECT MIN(pd.province_id) FROM district_city dc
+            JOIN province_district pd ON pd.district_id = dc.district_id
+        WHERE dc.city_id = u.city_id) AS province_id,
+       lb.listed_date
+FROM listed_books lb
+JOIN users u ON u.user_id = lb.user_id;
+
+CREATE OR REPLACE FUNCTION sync_listing_location()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM listing_locations WHERE list_id = OLD.list_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO listing_locations
+        SELECT * FROM listing_location_source WHERE list_id = NEW.list_id
+        ON CONFLICT (list_id) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_sync_listing_location ON listed_books;
+CREATE TRIGGER trigger_sync_listing_location
+AFTER INSERT OR UPDATE OR DELETE ON listed_books
+FOR EACH ROW EXECUTE FUNCTION sync_listing_location();
+
+CREATE OR REPLACE FUNCTION sync_user_listing_locations()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE listing_locations ll
+    SET city_id = src.city_id,
+        district_id = src.district_id,
+        province_id = src.province_id
+    FROM listing_location_source src
+    WHERE ll.user_id = NEW.user_id AND src.list_id = ll.list_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_sync_user_listing_locations ON users;
+CREATE TRIGGER trigger_sync_user_listing_locations
+AFTER UPDATE OF city_id ON users
+FOR EACH ROW WHEN (OLD.city_id IS DISTINCT FROM NEW.city_id)
+EXECUTE FUNCTION sync_user_listing_locations();
+
+CREATE OR REPLACE FUNCTION sync_hierarchy_listing_locations()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE listing_locations ll
+    SET district_id = src.district_id,
+        province_id = src.province_id
+    FROM listing_location_source src
+    WHERE src.list_id = ll.list_id
+      AND (ll.district_id, ll.province_id) IS DISTINCT FROM (src.district_id, src.province_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_sync_hierarchy_listing_locations ON district_city;
+CREATE TRIGGER trigger_sync_hierarchy_listing_locations
+AFTER INSERT OR UPDATE OR DELETE ON district_city
+FOR EACH STATEMENT EXECUTE FUNCTION sync_hierarchy_listing_locations();
+
+DROP TRIGGER IF EXISTS trigger_sync_hierarchy_listing_locations ON province_district;
+CREATE TRIGGER trigger_sync_hierarchy_listing_locations
+AFTER INSERT OR UPDATE OR DELETE ON province_district
+FOR EACH STATEMENT EXECUTE FUNCTION sync_hierarchy_listing_locations();
+
+-- Backfill listings that predate the projection
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM listing_locations) THEN
+        INSERT INTO listing_locations
+        SELECT * FROM listing_location_source
+        ON CONFLICT (list_id) DO NOTHING;
+    END IF;
+END;
+$$;
+"""
+
+# Conversation summary: last message and per-participant unread counters,
+# maintained by messaging.send_message and the mark-as-read step. Existing
+# conversations are backfilled from messages once.
+CONVERSATION_SUMMARY_SETUP = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'conversations' AND column_name = 'last_message_at'
+    ) THEN
+        ALTER TABLE conversations
+            ADD COLUMN last_message_id INTEGER,
+            ADD COLUMN last_message_at TIMESTAMP,
+            ADD COLUMN user1_unread INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN user2_unread INTEGER NOT NULL DEFAULT 0;
+
+        UPDATE conversations c
+        SET last_message_id = lm.message_id,
+            last_message_at = lm.sent_at
+        FROM (
+            SELECT DISTINCT ON (conversation_id) conversation_id, message_id, sent_at
+            FROM messages
+            ORDER BY conversation_id, sent_at DESC, message_id DESC
+        ) lm
+        WHERE lm.conversation_id = c.conversation_id;
+
+        UPDATE conversations SET last_message_at = created_at WHERE last_message_at IS NULL;
+
+        UPDATE conversations c
+        SET user1_unread = u.user1_unread,
+            user2_unread = u.user2_unread
+        FROM (
+            SELECT m.conversation_id,
+                   COUNT(*) FILTER (WHERE m.sender_id <> cc.user1_id) AS user1_unread,
+                   COUNT(*) FILTER (WHERE m.sender_id <> cc.user2_id) AS user2_unread
+            FROM messages m
+            JOIN conversations cc ON cc.conversation_id = m.conversation_id
+            WHERE NOT m.is_read
+            GROUP BY m.conversation_id
+        ) u
+        WHERE u.conversation_id = c.conversation_id;
+    END IF;
+END;
+$$;
+"""
+
+# Canonical (low_user_id, high_user_id) key for conversations. Databases
+# created before the key existed may hold the same pair twice; those
+# duplicates are merged into the oldest conversation before the unique index
+# is built.
+CONVERSATION_PAIRS_SETUP = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'conversations' AND column_name = 'low_user_id'
+    ) THEN
+        ALTER TABLE conversations
+            ADD COLUMN low_user_id INTEGER GENERATED ALWAYS AS (LEAST(user1_id, user2_id)) STORED,
+            ADD COLUMN high_user_id INTEGER GENERATED ALWAYS AS (GREATEST(user1_id, user2_id)) STORED;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE tablename = 'conversations' AND indexname = 'uq_conversations_pair'
+    ) THEN
+        CREATE TEMP TABLE conversation_merge AS
+        SELECT conversation_id, keep_id
+        FROM (
+            SELECT conversation_id,
+                   MIN(conversation_id) OVER (PARTITION BY low_user_id, high_user_id) AS keep_id
+            FROM conversations
+        ) pairs
+        WHERE conversation_id <> keep_id;
+
+        UPDATE messages m
+        SET conversation_id = cm.keep_id
+        FROM conversation_merge cm
+        WHERE m.conversation_id = cm.conversation_id;
+
+        DELETE FROM conversations c
+        USING conversation_merge cm
+        WHERE c.conversation_id = cm.conversation_id;
+
+        -- Recompute the inbox summary of every conversation that absorbed messages
+        UPDATE conversations c
+        SET last_message_id = lm.message_id,
+            last_message_at = lm.sent_at
+        FROM (
+            SELECT DISTINCT ON (conversation_id) conversation_id, message_id, sent_at
+            FROM messages
+            WHERE conversation_id IN (SELECT keep_id FROM conversation_merge)
+            ORDER BY conversation_id, sent_at DESC, message_id DESC
+        ) lm
+        WHERE lm.conversation_id = c.conversation_id;
+
+        UPDATE conversations c
+        SET user1_unread = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.conversation_id = c.conversation_id AND NOT m.is_read AND m.sender_id <> c.user1_id
+            ),
+            user2_unread = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.conversation_id = c.conversation_id AND NOT m.is_read AND m.sender_id <> c.user2_id
+            )
+        WHERE c.conversation_id IN (SELECT keep_id FROM conversation_merge);
+
+        DROP TABLE conversation_merge;
+
+        CREATE UNIQUE INDEX uq_conversations_pair ON conversations (low_user_id, high_user_id);
+    END IF;
+END;
+$$;
+"""
+
+# messages is range-partitioned by sent_at into monthly partitions
+# (messages_YYYY_MM) plus messages_default for anything no partition covers.
+# ensure_message_partitions() creates a month and the next one ahead of time;
+# rows that already landed in the default partition are moved into the new
+# partition before it is attached. An unpartitioned messages table from an
+# older database is converted in place, keeping message ids.
+#
+# archive_message_partitions() optionally folds every monthly partition before
+# a cutoff into messages_archive, a single lz4-compressed partition covering
+# (MINVALUE, cutoff). Archived messages stay readable through messages but are
+# pruned from queries on recent history.
+MESSAGE_PARTITIONS_SETUP = """
+CREATE OR REPLACE FUNCTION message_archive_bound()
+RETURNS DATE AS $$
+    SELECT split_part(pg_get_expr(c.relpartbound, c.oid), '''', 2)::DATE
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'messages'::regclass AND c.relname = 'messages_archive';
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION ensure_message_partition(month_start DATE)
+RETURNS VOID AS $$
+DECLARE
+    partition_name TEXT := 'messages_' || to_char(month_start, 'YYYY_MM');
+    month_end DATE := (month_start + INTERVAL '1 month')::DATE;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('messages_partitions'));
+    IF to_regclass(partition_name) IS NOT NULL OR month_start < message_archive_bound() THEN
+        RETURN;  -- Exists already, or the month was folded into the archive
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE messages INCLUDING DEFAULTS)', partition_name);
+    IF to_regclass('messages_default') IS NOT NULL THEN
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM messages_default WHERE sent_at >= %L AND sent_at < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            month_start, month_end, partition_name
+        );
+    END IF;
+    EXECUTE format(
+        'ALTER TABLE messages ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start, month_end
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_message_partitions(month_start DATE)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM ensure_message_partition(date_trunc('month', month_start)::DATE);
+    PERFORM ensure_message_partition((date_trunc('month', month_start) + INTERVAL '1 month')::DATE);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION archive_message_partitions(cutoff DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    partition_name TEXT;
+    archive_bound DATE := date_trunc('month', cutoff)::DATE;
+    archived INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('messages_partitions'));
+    -- The archive's range only ever grows
+    archive_bound := GREATEST(archive_bound, message_archive_bound());
+
+    IF to_regclass('messages_archive') IS NULL THEN
+        CREATE TABLE messages_archive (LIKE messages INCLUDING DEFAULTS);
+        BEGIN
+            ALTER TABLE messages_archive ALTER COLUMN content SET COMPRESSION lz4;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE NOTICE 'lz4 unavailable, messages_archive keeps the default compression';
+        END;
+    ELSIF message_archive_bound() IS NOT NULL THEN
+        ALTER TABLE messages DETACH PARTITION messages_archive;
+    END IF;
+
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+          AND c.relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+          AND to_date(substr(c.relname, 10), 'YYYY_MM') < archive_bound
+    LOOP
+        EXECUTE format('ALTER TABLE messages DETACH PARTITION %I', partition_name);
+        EXECUTE format('INSERT INTO messages_archive SELECT * FROM %I', partition_name);
+        EXECUTE format('DROP TABLE %I', partition_name);
+        archived := archived + 1;
+    END LOOP;
+
+    WITH moved AS (DELETE FROM messages_default WHERE sent_at < archive_bound RETURNING *)
+    INSERT INTO messages_archive SELECT * FROM moved;
+
+    EXECUTE format(
+        'ALTER TABLE messages ATTACH PARTITION messages_archive FOR VALUES FROM (MINVALUE) TO (%L)',
+        archive_bound
+    );
+    RETURN archived;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    first_month DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'messages' AND relkind = 'r') THEN
+        ALTER TABLE messages RENAME TO messages_unpartitioned;
+        ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey;
+        DROP INDEX IF EXISTS ix_messages_message_id;
+        DROP INDEX IF EXISTS ix_messages_conversation_sent_at;
+        DROP INDEX IF EXISTS ix_messages_unread;
+        DROP INDEX IF EXISTS ix_messages_content_search;
+
+        CREATE TABLE messages (
+            message_id INTEGER NOT NULL DEFAULT nextval('messages_message_id_seq'),
+            conversation_id INTEGER NOT NULL REFERENCES conversations (conversation_id),
+            sender_id INTEGER NOT NULL REFERENCES users (user_id),
+            content TEXT NOT NULL,
+            sent_at TIMESTAMP NOT NULL,
+            is_read BOOLEAN,
+            PRIMARY KEY (message_id, sent_at)
+        ) PARTITION BY RANGE (sent_at);
+        ALTER SEQUENCE messages_message_id_seq OWNED BY messages.message_id;
+        CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+        SELECT date_trunc('month', MIN(sent_at))::DATE INTO first_month FROM messages_unpartitioned;
+        PERFORM ensure_message_partition(month::DATE)
+        FROM generate_series(first_month::TIMESTAMP, date_trunc('month', now())::TIMESTAMP, INTERVAL '1 month') AS month;
+
+        INSERT INTO messages (message_id, conversation_id, sender_id, content, sent_at, is_read)
+        SELECT m.message_id, m.conversation_id, m.sender_id, m.content,
+               COALESCE(m.sent_at, c.created_at, now()::TIMESTAMP), m.is_read
+        FROM messages_unpartitioned m
+        JOIN conversations c ON c.conversation_id = m.conversation_id;
+
+        DROP TABLE messages_unpartitioned;
+    END IF;
+END;
+$$;
+
+CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT;
+SELECT ensure_message_partitions(now()::DATE);
+"""
+
+# Messaging indexes: each participant's inbox by recent activity, history
+# and unread messages per conversation, and full-text search over content
+MESSAGING_SETUP = """
+DROP INDEX IF EXISTS ix_conversations_user1_id;
+DROP INDEX IF EXISTS ix_conversations_user2_id;
+CREATE INDEX IF NOT EXISTS ix_conversations_user1_recent ON conversations (user1_id, last_message_at DESC);
+CREATE INDEX IF NOT EXISTS ix_conversations_user2_recent ON conversations (user2_id, last_message_at DESC);
+CREATE INDEX IF NOT EXISTS ix_messages_message_id ON messages (message_id);
+CREATE INDEX IF NOT EXISTS ix_messages_conversation_sent_at ON messages (conversation_id, sent_at, message_id);
+CREATE INDEX IF NOT EXISTS ix_messages_unread ON messages (conversation_id, sender_id) WHERE NOT is_read;
+CREATE INDEX IF NOT EXISTS ix_messages_content_search ON messages USING GIN (to_tsvector('english', content));
+"""
+
+# Version of the tables and DDL above. Bump it with every schema change so
+# existing databases re-run the bootstrap in database.init_db().
+SCHEMA_VERSION = 4
+
 # Function to initialize triggers
 def init_triggers():
     with engine.connect() as connection:
+        connection.execute(text(ID_SEQUENCES_SETUP))
+        connection.execute(text(LISTED_BOOKS_SETUP))
+        connection.execute(text(RATING_AGGREGATES_SETUP))
+        connection.execute(text(LOCATION_VERSION_SETUP))
+        connection.execute(text(CITY_COORDINATES_SETUP))
+        connection.execute(text(LISTING_LOCATIONS_SETUP))
+        connection.execute(text(CONVERSATION_SUMMARY_SETUP))
+        connection.execute(text(CONVERSATION_PAIRS_SETUP))
+        connection.execute(text(MESSAGE_PARTITIONS_SETUP))
+        connection.execute(text(MESSAGING_SETUP))
         connection.execute(text(BAYESIAN_TRIGGER_FUNCTION))
+        connection.execute(text(BULK_RATING_TRIGGER_FUNCTION))
         connection.commit()
 
 class User(Base):
     __tablename__ = "users"
 
-    user_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    user_id = Column(Integer, USER_ID_SEQUENCE, primary_key=True, index=True, autoincrement=True)
     name = Column(String, nullable=False)
     user_name = Column(String, nullable=False, unique=True, index=True)
     birth_year = Column(Date, nullable=False)
@@ -154,14 +786,15 @@ class User(Base):
 class Book(Base):
     __tablename__ = "books"
 
-    book_id = Column(Integer, primary_key=True, index=True)
+    book_id = Column(Integer, BOOK_ID_SEQUENCE, primary_key=True, index=True)
     title = Column(String, nullable=False)
     title_without_series = Column(String)
     mod_title = Column(String)
     isbn = Column(String)
     language_code = Column(String)
     publication_year = Column(Date)
-    rating_count = Column(Integer, default=0)
+    rating_count = Column(Integer, default=0)  # Updated by trigger
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")  # Updated by trigger
     average_rating = Column(Float, default=0.0)  # Updated by trigger
     authors = Column(ARRAY(Integer))
     cover_image_url = Column(String)
@@ -171,11 +804,19 @@ class Book(Base):
     listed = relationship("ListedBook", back_populates="book")
     requested = relationship("RequestedBook", back_populates="book")
 
+class RatingStats(Base):
+    __tablename__ = "rating_stats"
+
+    # Single row (stats_id = 1) holding running totals over user_book_ratings
+    stats_id = Column(Integer, primary_key=True)
+    rating_sum = Column(BigInteger, nullable=False, default=0)
+    rating_count = Column(BigInteger, nullable=False, default=0)
+
 class UserBookRating(Base):
     __tablename__ = "user_book_ratings"
 
     user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
-    book_id = Column(Integer, ForeignKey("books.book_id"), primary_key=True)
+    book_id = Column(Integer, ForeignKey("books.book_id"), primary_key=True, index=True)
     rating = Column(Integer)
     rated_date = Column(Date, default=datetime.utcnow)
 
@@ -185,15 +826,38 @@ class UserBookRating(Base):
 
 class ListedBook(Base):
     __tablename__ = "listed_books"
-    list_id = Column(Integer, primary_key=True, index=True)
+    list_id = Column(Integer, LIST_ID_SEQUENCE, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
     book_id = Column(Integer, ForeignKey("books.book_id"), primary_key=True)
     listed_date = Column(DateTime, default=lambda: datetime.now(datetime.UTC))
 
+    __table_args__ = (
+        Index("uq_listed_books_user_book", "user_id", "book_id", unique=True),
+    )
+
     # Relationships
     user = relationship("User", back_populates="listed_books")
     book = relationship("Book", back_populates="listed")
 
+class ListingLocation(Base):
+    __tablename__ = "listing_locations"
+
+    # Projection of listed_books maintained by triggers; read-only from the app
+    list_id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    book_id = Column(Integer, nullable=False, index=True)
+    city_id = Column(Integer)
+    district_id = Column(Integer)
+    province_id = Column(Integer)
+    listed_date = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_listing_locations_recent", listed_date.desc(), list_id.desc()),
+        Index("ix_listing_locations_city", city_id, listed_date.desc(), list_id.desc()),
+        Index("ix_listing_locations_district", district_id, listed_date.desc(), list_id.desc()),
+        Index("ix_listing_locations_province", province_id, listed_date.desc(), list_id.desc()),
+    )
+
 class RequestedBook(Base):
     __tablename__ = "requested_books"
 
@@ -229,11 +893,28 @@ class City(Base):
     
     city_id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
+    latitude = Column(Float)  # Degrees, used for distance-based search
+    longitude = Column(Float)
     
     # Relationships
     users = relationship("User", back_populates="city")
     districts = relationship("DistrictCity", back_populates="city")
 
+class LocationVersion(Base):
+    __tablename__ = 'location_version'
+
+    # Single row (version_id = 1) bumped by triggers on the location tables
+    version_id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=1)
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    # Single row (version_id = 1) holding the SCHEMA_VERSION last bootstrapped
+    version_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
 class ProvinceDistrict(Base):
     __tablename__ = 'province_district'
     
@@ -262,6 +943,22 @@ class Conversation(Base):
     user2_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Inbox summary, updated in the same transaction as each send and read
+    last_message_id = Column(Integer)
+    last_message_at = Column(DateTime, default=datetime.utcnow)
+    user1_unread = Column(Integer, nullable=False, default=0, server_default="0")
+    user2_unread = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # Order-independent pair key, so each pair of users has one conversation
+    low_user_id = Column(Integer, Computed("LEAST(user1_id, user2_id)", persisted=True))
+    high_user_id = Column(Integer, Computed("GREATEST(user1_id, user2_id)", persisted=True))
+
+    __table_args__ = (
+        Index("uq_conversations_pair", low_user_id, high_user_id, unique=True),
+        Index("ix_conversations_user1_recent", user1_id, last_message_at.desc()),
+        Index("ix_conversations_user2_recent", user2_id, last_message_at.desc()),
+    )
+
     # Relationships
     messages = relationship("Message", back_populates="conversation")
     user1 = relationship("User", foreign_keys=[user1_id])
@@ -270,13 +967,21 @@ class Conversation(Base):
 class Message(Base):
     __tablename__ = "messages"
 
-    message_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    # Partitioned by month of sent_at, which therefore is part of the key
+    message_id = Column(Integer, MESSAGE_ID_SEQUENCE, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.conversation_id"), nullable=False)
     sender_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     content = Column(Text, nullable=False)
-    sent_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
     is_read = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index("ix_messages_conversation_sent_at", conversation_id, sent_at, message_id),
+        Index("ix_messages_unread", conversation_id, sender_id, postgresql_where=~is_read),
+        Index("ix_messages_content_search", message_search_document(content), postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (sent_at)"},
+    )
+
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
     sender = relationship("User")
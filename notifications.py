@@ -0,0 +1,151 @@
+import queue
+import select
+import threading
+import time
+import weakref
+
+import psycopg2
+import psycopg2.extensions
+
+from models import DATABASE_URL
+
+# Every user gets their own channel; the payload is the conversation_id
+CHANNEL_PREFIX = "booxchange_inbox_"
+POLL_SECONDS = 1.0  # How long the listener waits on the socket before handling (un)subscribes
+RECONNECT_SECONDS = 5.0
+QUEUE_SIZE = 100  # Per-session backlog; older notifications are dropped when a session stops draining
+
+
+def user_channel(user_id):
+    """Name of the NOTIFY channel for a user's inbox."""
+    return f"{CHANNEL_PREFIX}{int(user_id)}"
+
+
+class _Listener(threading.Thread):
+    """
+    Holds one dedicated LISTEN connection per process and fans notifications
+    out to the queues of the sessions subscribed to each channel.
+
+    Subscriber queues are held weakly, so a session that goes away simply
+    stops receiving notifications and its channel is UNLISTENed.
+    """
+
+    def __init__(self):
+        super().__init__(name="booxchange-notify", daemon=True)
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> WeakSet of queues
+        self._listening = set()
+
+    def subscribe(self, channel, inbox):
+        with self._lock:
+            self._subscribers.setdefault(channel, weakref.WeakSet()).add(inbox)
+
+    def unsubscribe(self, channel, inbox):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(inbox)
+
+    def run(self):
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(DATABASE_URL)
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                self._listening = set()
+                self._listen(connection)
+            except psycopg2.Error as e:
+                print(f"Notification listener lost its connection: {e}")
+            except Exception as e:
+                # Anything else would end the thread and silently stop live updates
+                print(f"Notification listener failed, reconnecting: {e!r}")
+            finally:
+                if connection is not None:
+                    connection.close()
+            time.sleep(RECONNECT_SECONDS)
+
+    def _listen(self, connection):
+        with connection.cursor() as cursor:
+            while True:
+                self._sync_channels(cursor)
+                if select.select([connection], [], [], POLL_SECONDS) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self._dispatch(notify.channel, notify.payload)
+
+    def _sync_channels(self, cursor):
+        """LISTEN to newly subscribed channels and UNLISTEN abandoned ones."""
+        with self._lock:
+            for channel in [c for c, subscribers in self._subscribers.items() if not subscribers]:
+                del self._subscribers[channel]
+            wanted = set(self._subscribers)
+        for channel in wanted - self._listening:
+            cursor.execute(f'LISTEN "{channel}"')
+        for channel in self._listening - wanted:
+            cursor.execute(f'UNLISTEN "{channel}"')
+        self._listening = wanted
+
+    def _dispatch(self, channel, payload):
+        try:
+            conversation_id = int(payload)
+        except ValueError:
+            return
+        with self._lock:
+            inboxes = list(self._subscribers.get(channel, ()))
+        for inbox in inboxes:
+            try:
+                inbox.put_nowait(conversation_id)
+            except queue.Full:
+                pass
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _get_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = _Listener()
+            _listener.start()
+        return _listener
+
+
+def subscribe(user_id):
+    """
+    Subscribe to new-message notifications for a user.
+
+    Args:
+        user_id (int): User whose inbox to follow
+
+    Returns:
+        queue.Queue: Receives the conversation_id of each conversation with a
+        new message. Keep a reference to it (e.g. in session state) for as
+        long as the subscription should last.
+    """
+    inbox = queue.Queue(maxsize=QUEUE_SIZE)
+    _get_listener().subscribe(user_channel(user_id), inbox)
+    return inbox
+
+
+def unsubscribe(user_id, inbox):
+    """Stop delivering notifications to a queue returned by subscribe."""
+    _get_listener().unsubscribe(user_channel(user_id), inbox)
+
+
+def pending_conversations(inbox):
+    """
+    Drain a subscription queue without blocking.
+
+    Returns:
+        set: conversation_ids that received messages since the last call
+    """
+    conversation_ids = set()
+    while True:
+        try:
+            conversation_ids.add(inbox.get_nowait())
+        except queue.Empty:
+            return conversation_ids
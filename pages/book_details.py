@@ -6,6 +6,7 @@ from messaging import (
     get_or_create_conversation,  # Import the function to handle conversations
 )
 from models import ListedBook
+from thumbnails import cover_source
 
 
 def display_book_details():
@@ -43,7 +44,7 @@ def display_book_details():
         
         with col1:
             if book.cover_image_url:
-                st.image(book.cover_image_url, width=200)
+                st.image(cover_source(book.cover_image_url, 200), width=200)
             else:
                 st.write("No cover available")
                 
@@ -54,7 +55,7 @@ def display_book_details():
             st.write(f"Posted on: {listed_book.listed_date}")
             st.write(f"Book ID: {book_id}")
             if book.authors:
-                authors = book.authors if isinstance(book.authors, list) else [book.authors]
+                authors = book.authors if isinstance(book.authors, (list, tuple)) else [book.authors]
                 st.write(f"Authors: {', '.join(str(author) for author in authors)}")
             # Display current rating information
             st.write(f"Average Rating: {book.average_rating:.1f}/5 ({book.rating_count} ratings)")
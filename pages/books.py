@@ -1,18 +1,18 @@
 from datetime import datetime
 
-import numpy as np
-import pandas as pd
 import streamlit as st
 
 from crud import (
     create_book,
-    get_book_details,
+    get_books,
     get_user_listed_books,
     list_book,
     remove_listed_book,
 )
 from database import get_db
+from instrumentation import timed_page
 from models import Book
+from thumbnails import cover_source
 from utils import search
 
 
@@ -20,6 +20,7 @@ def search_book_by_isbn(db, isbn):
     """Search for a book in the database by ISBN."""
     return db.query(Book).filter(Book.isbn == isbn).first()
 
+@timed_page("my_books")
 def listed_books_page():
     if 'user_id' not in st.session_state:
         st.warning("Please login first")
@@ -60,14 +61,14 @@ def listed_books_page():
                 
                 with col1:
                     if book.cover_image_url:
-                        st.image(book.cover_image_url, width=100)
+                        st.image(cover_source(book.cover_image_url, 100), width=100)
                     else:
                         st.write("No cover available")
                 
                 with col2:
                     st.write(f"**{book.title}**")
                     if hasattr(book, 'authors') and book.authors:
-                        authors = book.authors if isinstance(book.authors, list) else [book.authors]
+                        authors = book.authors if isinstance(book.authors, (list, tuple)) else [book.authors]
                         st.write(f"By: {', '.join(str(author) for author in authors)}")
                     st.write(f"ISBN: {book.isbn}")
                 
@@ -89,8 +90,7 @@ def listed_books_page():
             
             if st.button("Search by Title") and search_query:
                 book_ids = search(search_query)
-                books = [get_book_details(db, book_id) for book_id in book_ids if get_book_details(db, book_id)]
-                st.session_state.search_results = books
+                st.session_state.search_results = get_books(db, book_ids)
                 st.session_state.selected_book = None
                 st.session_state.isbn_search_result = None
             
@@ -102,13 +102,13 @@ def listed_books_page():
                     
                     with col1:
                         if book.cover_image_url:
-                            st.image(book.cover_image_url, width=80)
+                            st.image(cover_source(book.cover_image_url, 80), width=80)
                     
                     with col2:
                         st.write(f"**{book.title}**")
                         st.write(f"ISBN: {book.isbn}")
                         if hasattr(book, 'authors') and book.authors:
-                            authors = book.authors if isinstance(book.authors, list) else [book.authors]
+                            authors = book.authors if isinstance(book.authors, (list, tuple)) else [book.authors]
                             st.write(f"By: {', '.join(str(author) for author in authors)}")
                     
                     with col3:
@@ -163,12 +163,12 @@ def listed_books_page():
                 
                 with col1:
                     if st.session_state.selected_book.cover_image_url:
-                        st.image(st.session_state.selected_book.cover_image_url, width=100)
+                        st.image(cover_source(st.session_state.selected_book.cover_image_url, 100), width=100)
                 
                 with col2:
                     st.write(f"**{st.session_state.selected_book.title}**")
                     if hasattr(st.session_state.selected_book, 'authors') and st.session_state.selected_book.authors:
-                        authors = st.session_state.selected_book.authors if isinstance(st.session_state.selected_book.authors, list) else [st.session_state.selected_book.authors]
+                        authors = st.session_state.selected_book.authors if isinstance(st.session_state.selected_book.authors, (list, tuple)) else [st.session_state.selected_book.authors]
                         st.write(f"By: {', '.join(str(author) for author in authors)}")
                 
                 if st.button("Confirm and List This Book"):
@@ -201,13 +201,13 @@ def listed_books_page():
                 col1, col2, col3 = st.columns([2, 3, 1])
                 with col1:
                     if book.cover_image_url:
-                        st.image(book.cover_image_url, width=100)
+                        st.image(cover_source(book.cover_image_url, 100), width=100)
                     else:
                         st.write("No cover available")
                 with col2:
                     st.subheader(book.title)
                     if hasattr(book, 'authors') and book.authors:
-                        authors = book.authors if isinstance(book.authors, list) else [book.authors]
+                        authors = book.authors if isinstance(book.authors, (list, tuple)) else [book.authors]
                         st.write(f"Authors: {', '.join(str(author) for author in authors)}")
                 with col3:
                     if st.button("Remove", key=f"remove_{book.book_id}"):
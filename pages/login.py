@@ -1,21 +1,17 @@
 from datetime import date
 
 import streamlit as st
-from sqlalchemy import text
 
 from crud import create_user, verify_user
 from database import get_db
+from location_tree import get_location_tree
 
 
 def get_cities_from_db():
-    with get_db() as db:
-        cities = db.execute(text("SELECT name FROM city")).fetchall()
-        return [city.name for city in cities]
+    return sorted(get_location_tree().city_names.values())
     
 def get_city_id(city_name):
-    with get_db() as db:
-        city = db.execute(text("SELECT city_id FROM city WHERE name = :name"), {"name": city_name}).fetchone()
-        return city.city_id if city else None
+    return get_location_tree().city_ids_by_name.get(city_name)
 
 def login_page():
     st.title("Booxchange")
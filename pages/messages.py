@@ -1,9 +1,116 @@
 import streamlit as st
 
 from database import get_db
-from messaging import get_conversation_messages, get_user_conversations, send_message
+from instrumentation import timed_page
+from messaging import (
+    get_conversation_messages,
+    get_conversation_summary,
+    get_user_conversations,
+    search_messages,
+    send_message,
+)
+from notifications import pending_conversations, subscribe
 
+# Conversations shown per page of the inbox
+INBOX_PAGE_SIZE = 50
+# Messages loaded per page of a conversation's history
+HISTORY_PAGE_SIZE = 50
+# Results shown per page of message search
+SEARCH_PAGE_SIZE = 20
+# How often an open conversation checks for pushed notifications (in-memory, no query)
+NOTIFICATION_POLL_SECONDS = 2
 
+
+@st.fragment(run_every=NOTIFICATION_POLL_SECONDS)
+def conversation_panel(conversation_id, other_user_id, other_user):
+    """
+    Show one conversation. Reruns on a timer but only queries the database
+    when a notification arrived for it; a message in any other conversation
+    reruns the whole page so the inbox is refreshed.
+    """
+    user_id = st.session_state.user_id
+    changed = pending_conversations(st.session_state.inbox_subscription[1])
+    if changed - {conversation_id}:
+        st.rerun()
+
+    if st.session_state.get('history_conversation') != conversation_id:
+        st.session_state.history_conversation = conversation_id
+        st.session_state.older_messages = []
+        st.session_state.older_cursor = None
+        st.session_state.history_boundary = None
+        st.session_state.history_stale = True
+
+    if st.session_state.history_stale or conversation_id in changed:
+        with get_db() as db:
+            if st.session_state.history_boundary:
+                # Older pages are loaded: keep everything from the oldest page boundary onwards
+                st.session_state.recent_messages, _ = get_conversation_messages(
+                    db, conversation_id, user_id, since=st.session_state.history_boundary)
+            else:
+                st.session_state.recent_messages, st.session_state.older_cursor = get_conversation_messages(
+                    db, conversation_id, user_id, limit=HISTORY_PAGE_SIZE)
+        st.session_state.history_stale = False
+
+    st.subheader(f"Chat with: {other_user}")
+
+    if st.session_state.older_cursor and st.button("Load older messages"):
+        cursor = st.session_state.older_cursor
+        with get_db() as db:
+            older, st.session_state.older_cursor = get_conversation_messages(
+                db, conversation_id, user_id, limit=HISTORY_PAGE_SIZE, before=cursor)
+        st.session_state.older_messages = older + st.session_state.older_messages
+        if not st.session_state.history_boundary:
+            st.session_state.history_boundary = cursor
+        st.rerun(scope="fragment")
+
+    # Display messages
+    for msg in st.session_state.older_messages + st.session_state.recent_messages:
+        if msg['is_sent_by_user']:
+            st.write(f"You ({msg['sent_at']}): {msg['content']}")
+        else:
+            st.write(f"{msg['sender']} ({msg['sent_at']}): {msg['content']}")
+
+    # Send new message
+    with st.form(key="send_message_form", clear_on_submit=True):
+        new_message = st.text_area("Type your message")
+        if st.form_submit_button("Send"):
+            if new_message.strip():
+                with get_db() as db:
+                    send_message(db, user_id, other_user_id, new_message)
+                st.success("Message sent!")
+                st.rerun()
+            else:
+                st.error("Message cannot be empty.")
+
+
+def search_panel(db, user_id):
+    """Search box over the user's messages; picking a result opens its conversation."""
+    query = st.text_input("Search messages", key="message_search")
+    if st.session_state.get('search_for') != query:
+        st.session_state.search_for = query
+        st.session_state.search_limit = SEARCH_PAGE_SIZE
+    if not query.strip():
+        return
+
+    results = search_messages(db, user_id, query, limit=st.session_state.search_limit)
+    if not results:
+        st.info("No messages match your search.")
+        return
+    for result in results:
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            st.write(f"**{result['other_user']}** - {result['sender']} ({result['sent_at']}): {result['snippet']}")
+        with col2:
+            if st.button("Open", key=f"search_{result['message_id']}"):
+                st.session_state.selected_conversation = result['conversation_id']
+                st.rerun()
+    if len(results) >= st.session_state.search_limit and st.button("More results"):
+        st.session_state.search_limit += SEARCH_PAGE_SIZE
+        st.rerun()
+    st.divider()
+
+
+@timed_page("messages")
 def messages_page():
     if 'user_id' not in st.session_state or not st.session_state.user_id:
         st.warning("Please login to access messages.")
@@ -14,15 +121,25 @@ def messages_page():
     # Initialize session state for selected conversation
     if 'selected_conversation' not in st.session_state:
         st.session_state.selected_conversation = None
+    if 'inbox_limit' not in st.session_state:
+        st.session_state.inbox_limit = INBOX_PAGE_SIZE
+
+    subscription = st.session_state.get('inbox_subscription')
+    if subscription is None or subscription[0] != st.session_state.user_id:
+        st.session_state.inbox_subscription = (st.session_state.user_id, subscribe(st.session_state.user_id))
+    # This run reads the inbox fresh, so anything already queued is covered
+    pending_conversations(st.session_state.inbox_subscription[1])
 
     with get_db() as db:
         # Fetch user's conversations
-        conversations = get_user_conversations(db, st.session_state.user_id)
+        conversations = get_user_conversations(db, st.session_state.user_id, limit=st.session_state.inbox_limit)
 
         if not conversations:
             st.info("You have no conversations yet.")
             return
 
+        search_panel(db, st.session_state.user_id)
+
         # Sidebar: List of conversations
         st.sidebar.subheader("Conversations")
         for conv in conversations:
@@ -30,35 +147,24 @@ def messages_page():
             if st.sidebar.button(f"{conv['other_user']} - {conv['latest_message'][:20]}{unread_badge}",
                                 key=f"conv_{conv['conversation_id']}"):
                 st.session_state.selected_conversation = conv['conversation_id']
+        if len(conversations) >= st.session_state.inbox_limit and st.sidebar.button("Show more conversations"):
+            st.session_state.inbox_limit += INBOX_PAGE_SIZE
+            st.rerun()
 
         # Main area: Selected conversation
         if st.session_state.selected_conversation:
-            messages = get_conversation_messages(db, st.session_state.selected_conversation, st.session_state.user_id)
-            other_user = next(conv['other_user'] for conv in conversations 
-                            if conv['conversation_id'] == st.session_state.selected_conversation)
-            
-            st.subheader(f"Chat with: {other_user}")
-            
-            # Display messages
-            for msg in messages:
-                if msg['is_sent_by_user']:
-                    st.write(f"You ({msg['sent_at']}): {msg['content']}")
-                else:
-                    st.write(f"{msg['sender']} ({msg['sent_at']}): {msg['content']}")
-
-            # Send new message
-            with st.form(key="send_message_form", clear_on_submit=True):
-                new_message = st.text_area("Type your message")
-                if st.form_submit_button("Send"):
-                    if new_message.strip():
-                        send_message(db, st.session_state.user_id, 
-                                   next(conv for conv in conversations 
-                                        if conv['conversation_id'] == st.session_state.selected_conversation)['other_user_id'],
-                                   new_message)
-                        st.success("Message sent!")
-                        st.rerun()
-                    else:
-                        st.error("Message cannot be empty.")
+            selected = next((conv for conv in conversations
+                             if conv['conversation_id'] == st.session_state.selected_conversation), None)
+            if selected is None:
+                # Selected from elsewhere (e.g. "Message User") and not on the current inbox page
+                selected = get_conversation_summary(db, st.session_state.user_id, st.session_state.selected_conversation)
+        else:
+            selected = None
+
+        if selected:
+            # A full run reloads the conversation; fragment reruns only reload it on a notification
+            st.session_state.history_stale = True
+            conversation_panel(st.session_state.selected_conversation, selected['other_user_id'], selected['other_user'])
         else:
             st.info("Select a conversation from the sidebar to start chatting.")
 
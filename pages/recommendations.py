@@ -1,12 +1,15 @@
 # pages/recommendations.py
 import streamlit as st
-from sqlalchemy import desc
 
 from collaborative_filter import get_recommendations
+from crud import get_books
 from database import get_db
-from models import Book, City, ListedBook, User
+from instrumentation import timed_page
+from location_filter import load_listings_for_books
+from thumbnails import cover_source
 
 
+@timed_page("recommendations")
 def display_recommendations():
     st.title("Recomended For You")
 
@@ -24,11 +27,7 @@ def display_recommendations():
     st.subheader("All Recommended Books")
     with st.expander("View all recommendations", expanded=False):
         with get_db() as db:
-            all_recs = (
-                db.query(Book)
-                .filter(Book.book_id.in_(recommended_book_ids))
-                .all()
-            )
+            all_recs = get_books(db, recommended_book_ids)
             if not all_recs:
                 st.write("No books found for these recommendations.")
             else:
@@ -39,7 +38,7 @@ def display_recommendations():
                     for idx, book in enumerate(row_books):
                         with cols[idx]:
                             if book.cover_image_url:
-                                st.image(book.cover_image_url, width=50)
+                                st.image(cover_source(book.cover_image_url, 50), width=50)
                             else:
                                 st.write("No cover")
                             st.write(book.title)
@@ -48,34 +47,23 @@ def display_recommendations():
     st.subheader("Available in the Community")
 
     # Initialize session state for pagination
-    if 'rec_offset' not in st.session_state:
-        st.session_state.rec_offset = 0
+    if 'rec_cursor' not in st.session_state:
+        st.session_state.rec_cursor = None
+    if 'recs_exhausted' not in st.session_state:
+        st.session_state.recs_exhausted = False
     if 'displayed_recs' not in st.session_state:
         st.session_state.displayed_recs = []
     if 'total_recs_loaded' not in st.session_state:
         st.session_state.total_recs_loaded = 0
 
-    def load_recommendations(offset, limit=20):
-        with get_db() as db:
-            recs = (
-                db.query(ListedBook, Book, User, City)
-                .join(Book, ListedBook.book_id == Book.book_id)
-                .join(User, ListedBook.user_id == User.user_id)
-                .join(City, User.city_id == City.city_id)
-                .filter(ListedBook.book_id.in_(recommended_book_ids))
-                .order_by(desc(ListedBook.listed_date))
-                .offset(offset)
-                .limit(limit)
-                .all()
-            )
-            return recs
-
     # Load initial batch or next batch
     def load_next_batch():
-        new_recs = load_recommendations(st.session_state.rec_offset)
+        if st.session_state.recs_exhausted:
+            return
+        new_recs, st.session_state.rec_cursor = load_listings_for_books(recommended_book_ids, st.session_state.rec_cursor)
+        st.session_state.recs_exhausted = st.session_state.rec_cursor is None
         if new_recs:
             st.session_state.displayed_recs.extend(new_recs)
-            st.session_state.rec_offset += len(new_recs)
             st.session_state.total_recs_loaded += len(new_recs)
 
             # Memory management: keep only the most recent 40 books
@@ -85,38 +73,38 @@ def display_recommendations():
                 st.session_state.total_recs_loaded = 40
 
     # Initial load
-    if not st.session_state.displayed_recs:
+    if not st.session_state.displayed_recs and not st.session_state.recs_exhausted:
         load_next_batch()
 
     # Display listed recommended books in a grid
     if not st.session_state.displayed_recs:
         st.info("No recommended books currently listed by the community.")
     else:
-        for i, (listed_book, book, user, city) in enumerate(st.session_state.displayed_recs):
+        for i, listing in enumerate(st.session_state.displayed_recs):
             col1, col2 = st.columns([1, 3])
 
             with col1:
-                if book.cover_image_url:
-                    st.image(book.cover_image_url, width=100)  # Larger cover image for listed books
+                if listing.cover_image_url:
+                    st.image(cover_source(listing.cover_image_url, 100), width=100)  # Larger cover image for listed books
                 else:
                     st.write("No cover")
 
             with col2:
-                if st.button(f"{book.title}", key=f"rec_{listed_book.list_id}_{i}"):
+                if st.button(f"{listing.title}", key=f"rec_{listing.list_id}_{i}"):
                     st.session_state.selected_book = {
-                        'list_id': listed_book.list_id,
-                        'book_id': book.book_id,
-                        'user_id': user.user_id
+                        'list_id': listing.list_id,
+                        'book_id': listing.book_id,
+                        'user_id': listing.user_id
                     }
                     st.switch_page("pages/book_details.py")
 
-                st.write(f"Rating: {book.average_rating}")
-                st.write(f"Posted: {listed_book.listed_date}")
-                st.write(f"Location: {city.name}")
+                st.write(f"Rating: {listing.average_rating}")
+                st.write(f"Posted: {listing.listed_date}")
+                st.write(f"Location: {listing.city_name}")
                 st.write("---")
 
     # Load more button
-    if st.button("Load More"):
+    if not st.session_state.recs_exhausted and st.button("Load More"):
         load_next_batch()
         st.rerun()
 
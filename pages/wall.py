@@ -1,22 +1,82 @@
 import streamlit as st
 
 from database import get_db
+from instrumentation import timed_page
 from location_filter import (
     get_cities,
     get_districts,
+    get_listing_facets,
     get_provinces,
     get_user_location,
     load_filtered_books,
+    load_nearby_books,
+    prefetch_filtered_books,
 )
+from thumbnails import cover_source
 
+# Listings shown in "Books near me" mode
+NEARBY_DEFAULT_RADIUS_KM = 10
+NEARBY_LIMIT = 40
 
+
+def render_listing(listing, key):
+    """Show one listing row; key makes its buttons unique on the page."""
+    col1, col2 = st.columns([1, 3])
+
+    with col1:
+        if listing.cover_image_url:
+            st.image(cover_source(listing.cover_image_url, 100), width=100)
+        else:
+            st.write("No cover")
+
+    with col2:
+        if st.button(f"{listing.title}", key=f"book_{key}_{listing.list_id}"):
+            st.session_state.selected_book = {
+                'list_id': listing.list_id,
+                'book_id': listing.book_id,
+                'user_id': listing.user_id
+            }
+            st.switch_page("pages/book_details.py")
+
+        # Add Message User button (only if logged in and not the same user)
+        if 'user_id' in st.session_state and st.session_state.user_id and st.session_state.user_id != listing.user_id:
+            if st.button("Message User", key=f"msg_{key}_{listing.list_id}"):
+                with get_db() as db:
+                    from messaging import get_or_create_conversation
+                    conv = get_or_create_conversation(db, st.session_state.user_id, listing.user_id)
+                    st.session_state.selected_conversation = conv.conversation_id
+                    st.switch_page("pages/messages.py")
+
+        st.write(f"Rating: {listing.average_rating}")
+        st.write(f"Posted: {listing.listed_date}")
+        if listing.distance_km is not None:
+            st.write(f"Location: {listing.city_name} ({listing.distance_km:.1f} km away)")
+        else:
+            st.write(f"Location: {listing.city_name}")
+        st.write("---")
+
+
+def display_nearby(user_id):
+    """Listings from cities within a chosen radius of the user's city, nearest first."""
+    radius_km = st.slider("Distance (km)", min_value=5, max_value=100, value=NEARBY_DEFAULT_RADIUS_KM, step=5, key="nearby_radius")
+    listings = load_nearby_books(user_id, radius_km=radius_km, limit=NEARBY_LIMIT)
+    if not listings:
+        st.write("No listed books found near you.")
+        return
+    for i, listing in enumerate(listings):
+        render_listing(listing, f"near_{i}")
+
+
+@timed_page("wall")
 def display_wall():
     st.title("Booxchange - Book Wall")
     st.write("Discover books shared by the community")
 
     # Initialize session state
-    if 'wall_offset' not in st.session_state:
-        st.session_state.wall_offset = 0
+    if 'wall_cursor' not in st.session_state:
+        st.session_state.wall_cursor = None
+    if 'wall_exhausted' not in st.session_state:
+        st.session_state.wall_exhausted = False
     if 'displayed_books' not in st.session_state:
         st.session_state.displayed_books = []
     if 'total_loaded' not in st.session_state:
@@ -39,15 +99,35 @@ def display_wall():
         else:
             st.session_state.selected_city_id = None
 
-    # Fetch location options
-    province_options = get_provinces()
+    # Logged-in users can switch to listings near their own city
+    if st.session_state.get('user_id'):
+        if st.toggle("Books near me", key="nearby_mode"):
+            display_nearby(st.session_state.user_id)
+            return
+
+    # Fetch location options, hiding areas without listings (except the current selection)
+    facets = get_listing_facets(st.session_state.search_query)
+
+    def with_listings(options, counts, selected_id):
+        return {name: oid for name, oid in options.items() if counts.get(oid) or oid == selected_id}
+
+    def facet_label(options, counts, all_count):
+        def label(name):
+            count = counts.get(options[name], 0) if name in options else all_count
+            return f"{name} ({count})"
+        return label
+
+    province_options = with_listings(get_provinces(), facets["province"], st.session_state.selected_province_id)
     province_names = ["All Provinces"] + list(province_options.keys())
+    all_provinces_count = facets["total"]
     
-    district_options = get_districts(st.session_state.selected_province_id)
+    district_options = with_listings(get_districts(st.session_state.selected_province_id), facets["district"], st.session_state.selected_district_id)
     district_names = ["All Districts"] + list(district_options.keys())
+    all_districts_count = facets["province"].get(st.session_state.selected_province_id, 0) if st.session_state.selected_province_id else all_provinces_count
     
-    city_options = get_cities(st.session_state.selected_district_id)
+    city_options = with_listings(get_cities(st.session_state.selected_district_id), facets["city"], st.session_state.selected_city_id)
     city_names = ["All Cities"] + list(city_options.keys())
+    all_cities_count = facets["district"].get(st.session_state.selected_district_id, 0) if st.session_state.selected_district_id else all_districts_count
 
     # Location filter dropdowns
     col1, col2, col3 = st.columns(3)
@@ -58,6 +138,7 @@ def display_wall():
             options=province_names,
             index=province_names.index("All Provinces") if st.session_state.selected_province_id is None else list(province_options.keys()).index(
                 next(name for name, pid in province_options.items() if pid == st.session_state.selected_province_id)) + 1,
+            format_func=facet_label(province_options, facets["province"], all_provinces_count),
             key="province_filter"
         )
         new_province_id = province_options.get(selected_province_name) if selected_province_name != "All Provinces" else None
@@ -72,6 +153,7 @@ def display_wall():
             options=district_names,
             index=district_names.index("All Districts") if st.session_state.selected_district_id is None else list(district_options.keys()).index(
                 next(name for name, did in district_options.items() if did == st.session_state.selected_district_id)) + 1,
+            format_func=facet_label(district_options, facets["district"], all_districts_count),
             key="district_filter"
         )
         new_district_id = district_options.get(selected_district_name) if selected_district_name != "All Districts" else None
@@ -85,6 +167,7 @@ def display_wall():
             options=city_names,
             index=city_names.index("All Cities") if st.session_state.selected_city_id is None else list(city_options.keys()).index(
                 next(name for name, cid in city_options.items() if cid == st.session_state.selected_city_id)) + 1,
+            format_func=facet_label(city_options, facets["city"], all_cities_count),
             key="city_filter"
         )
         st.session_state.selected_city_id = city_options.get(selected_city_name) if selected_city_name != "All Cities" else None
@@ -92,17 +175,61 @@ def display_wall():
     # Search bar
     search_input = st.text_input("Search for a book", value=st.session_state.search_query, key="search_input")
 
+    def current_filters():
+        return {
+            'search_query': st.session_state.search_query if st.session_state.search_query else None,
+            'province_id': st.session_state.selected_province_id,
+            'district_id': st.session_state.selected_district_id,
+            'city_id': st.session_state.selected_city_id,
+        }
+
+    def prefetch_key():
+        return tuple(current_filters().values()), st.session_state.wall_cursor
+
+    def cancel_prefetch():
+        prefetch = st.session_state.get('wall_prefetch')
+        if prefetch:
+            prefetch[1].cancel()
+        st.session_state.wall_prefetch = None
+
+    def start_prefetch():
+        # Fetch the page after the one just rendered while the user reads
+        if st.session_state.wall_exhausted:
+            return
+        prefetch = st.session_state.get('wall_prefetch')
+        if prefetch and prefetch[0] == prefetch_key():
+            return
+        cancel_prefetch()
+        future = prefetch_filtered_books(st.session_state.wall_cursor, **current_filters())
+        if future is not None:
+            st.session_state.wall_prefetch = (prefetch_key(), future)
+
+    def reset_feed():
+        cancel_prefetch()
+        st.session_state.wall_cursor = None
+        st.session_state.wall_exhausted = False
+        st.session_state.displayed_books = []
+        st.session_state.total_loaded = 0
+
     def load_next_batch():
-        new_books = load_filtered_books(
-            st.session_state.wall_offset,
-            search_query=st.session_state.search_query if st.session_state.search_query else None,
-            province_id=st.session_state.selected_province_id,
-            district_id=st.session_state.selected_district_id,
-            city_id=st.session_state.selected_city_id
-        )
+        if st.session_state.wall_exhausted:
+            return
+        prefetch = st.session_state.get('wall_prefetch')
+        st.session_state.wall_prefetch = None
+        batch = None
+        if prefetch and prefetch[0] == prefetch_key() and not prefetch[1].cancelled():
+            try:
+                batch = prefetch[1].result()
+            except Exception as e:
+                print(f"Prefetched wall page failed, loading it again: {e}")
+        elif prefetch:
+            prefetch[1].cancel()
+        if batch is None:
+            batch = load_filtered_books(st.session_state.wall_cursor, **current_filters())
+        new_books, st.session_state.wall_cursor = batch
+        st.session_state.wall_exhausted = st.session_state.wall_cursor is None
         if new_books:
             st.session_state.displayed_books.extend(new_books)
-            st.session_state.wall_offset += 20
             st.session_state.total_loaded += len(new_books)
 
             if st.session_state.total_loaded > 40:
@@ -110,21 +237,18 @@ def display_wall():
                 st.session_state.displayed_books = st.session_state.displayed_books[excess:]
                 st.session_state.total_loaded = 40
 
-    # Handle search or filter change
+    # Handle search change: rerun so the location facets above are counted
+    # for the new query before the feed is loaded
     if search_input != st.session_state.search_query:
         st.session_state.search_query = search_input
-        st.session_state.wall_offset = 0
-        st.session_state.displayed_books = []
-        st.session_state.total_loaded = 0
-        load_next_batch()
+        reset_feed()
+        st.rerun()
 
     # Initial load or filter change
     if (not st.session_state.displayed_books or
         'last_filters' not in st.session_state or
         st.session_state.last_filters != (st.session_state.selected_province_id, st.session_state.selected_district_id, st.session_state.selected_city_id)):
-        st.session_state.wall_offset = 0
-        st.session_state.displayed_books = []
-        st.session_state.total_loaded = 0
+        reset_feed()
         load_next_batch()
         st.session_state.last_filters = (st.session_state.selected_province_id, st.session_state.selected_district_id, st.session_state.selected_city_id)
 
@@ -147,45 +271,17 @@ def display_wall():
     if not st.session_state.displayed_books:
         st.write("No matching listed books found.")
     else:
-        for i, (listed_book, book, user, city) in enumerate(st.session_state.displayed_books):
-            col1, col2 = st.columns([1, 3])
-
-            with col1:
-                if book.cover_image_url:
-                    st.image(book.cover_image_url, width=100)
-                else:
-                    st.write("No cover")
-
-            with col2:
-                unique_key = f"book_{st.session_state.render_count}_{i}_{listed_book.list_id}"
-                if st.button(f"{book.title}", key=unique_key):
-                    st.session_state.selected_book = {
-                        'list_id': listed_book.list_id,
-                        'book_id': book.book_id,
-                        'user_id': user.user_id
-                    }
-                    st.switch_page("pages/book_details.py")
-
-                # Add Message User button (only if logged in and not the same user)
-                if 'user_id' in st.session_state and st.session_state.user_id and st.session_state.user_id != user.user_id:
-                    if st.button("Message User", key=f"msg_{listed_book.list_id}_{i}"):
-                        with get_db() as db:
-                            from messaging import get_or_create_conversation
-                            conv = get_or_create_conversation(db, st.session_state.user_id, user.user_id)
-                            st.session_state.selected_conversation = conv.conversation_id
-                            st.switch_page("pages/messages.py")
-
-                st.write(f"Rating: {book.average_rating}")
-                st.write(f"Posted: {listed_book.listed_date}")
-                st.write(f"Location: {city.name}")
-                st.write("---")
+        for i, listing in enumerate(st.session_state.displayed_books):
+            render_listing(listing, f"{st.session_state.render_count}_{i}")
 
     # Load more button
-    if st.button("Load More", key="load_more_button"):
+    if not st.session_state.wall_exhausted and st.button("Load More", key="load_more_button"):
         load_next_batch()
         st.session_state.render_count += 1
         st.rerun()
 
+    start_prefetch()
+
     # Infinite scroll simulation
     with st.empty():
         if st.session_state.total_loaded >= 20 and not st.session_state.search_query and not any([st.session_state.selected_province_id, st.session_state.selected_district_id, st.session_state.selected_city_id]):
@@ -0,0 +1,43 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, tuple_
+
+
+def encode_cursor(sort_date, row_id):
+    """Encode the (sort_date, row_id) of the last row shown as an opaque cursor."""
+    payload = json.dumps([sort_date.isoformat(), row_id])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor into (sort_date, row_id)."""
+    sort_date, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return datetime.fromisoformat(sort_date), int(row_id)
+
+
+def after_cursor(date_column, id_column, cursor):
+    """
+    Build the keyset condition for rows that come after the cursor when
+    ordering by (date_column DESC, id_column DESC). The plain bound on
+    date_column lets the planner prune partitions and index ranges.
+    """
+    sort_date, row_id = decode_cursor(cursor)
+    return and_(date_column <= sort_date, tuple_(date_column, id_column) < tuple_(sort_date, row_id))
+
+
+def from_cursor(date_column, id_column, cursor):
+    """Build the condition for the cursor row and every row newer than it."""
+    sort_date, row_id = decode_cursor(cursor)
+    return and_(date_column >= sort_date, tuple_(date_column, id_column) >= tuple_(sort_date, row_id))
+
+
+def next_cursor(rows, limit, key):
+    """
+    Return the cursor for the page after rows, or None when rows was the last
+    page. key maps a row to its (sort_date, row_id).
+    """
+    if len(rows) < limit:
+        return None
+    return encode_cursor(*key(rows[-1]))
@@ -1,10 +1,13 @@
+import os
+
 import bcrypt
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
-from crud import list_book
-from models import DATABASE_URL, Book, User
+from crud import bulk_list_books
+from database import defer_rating_aggregates
+from models import BOOK_ID_SEQUENCE, DATABASE_URL, USER_ID_SEQUENCE, Book, User
 
 
 # Convert the authors column to the correct format
@@ -13,6 +16,17 @@ def format_authors(authors):
         return None
     return '{' + ','.join(authors.split(',')) + '}'
 
+def sync_id_sequence(engine, table, column, sequence):
+    """
+    Move an ID sequence past the IDs a CSV load inserted explicitly, so rows
+    created by the app afterwards don't collide with them.
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text("SELECT sync_id_sequence(:table, :column, :sequence)"),
+            {"table": table, "column": column, "sequence": sequence.name}
+        )
+
 def populate_books():
     # Create a database engine
     engine = create_engine(DATABASE_URL)
@@ -28,7 +42,10 @@ def populate_books():
     books_df['mod_title'] = books_df['mod_title'].str.replace(r'\s+', ' ', regex=True)
     books_df['mod_title'] = books_df['mod_title'].str.lower()
 
-    books_df = books_df.rename(columns={'ratings_count': 'rating_count'})
+    # Rating counts are maintained from user_book_ratings by the triggers; the
+    # CSV's count would not match the loaded ratings or the running rating_sum
+    books_df = books_df.drop(columns=['ratings_count'], errors='ignore')
+    books_df['rating_count'] = 0
     books_df = books_df.rename(columns={'image_url': 'cover_image_url'})
     books_df['authors'] = books_df['authors'].apply(format_authors)
 
@@ -37,6 +54,7 @@ def populate_books():
 
     # Insert the data into the database
     books_df.to_sql('books', engine, if_exists='append', index=False)
+    sync_id_sequence(engine, 'books', 'book_id', BOOK_ID_SEQUENCE)
 
 
     print("Data has been successfully inserted into the database.")
@@ -56,6 +74,35 @@ def populate_cities():
 
     print("Data has been successfully inserted into the database.")
 
+def populate_city_coordinates(engine=None):
+    """
+    Optional step after populate_cities: fill city.latitude/longitude for the
+    "Books near me" wall. city_coordinates.csv is not one of the project
+    datasets; build it with city_id, latitude and longitude columns by
+    matching city.csv names against the GeoNames LK gazetteer
+    (https://download.geonames.org/export/dump/LK.zip). The update bumps
+    location_version, so running apps rebuild their city index.
+    """
+    engine = engine or create_engine(DATABASE_URL)
+
+    # Define the paths to your CSV files
+    coordinates_csv = "C:\\Users\\Amitha\\uni\\6th semester\\data management project\\book_recommendastion\\main\\final_datasets\\city_coordinates.csv"
+    if not os.path.exists(coordinates_csv):
+        print(f"Skipping city coordinates: {coordinates_csv} not found. Nearby search falls back to the user's own city.")
+        return
+
+    # Read the CSV files into DataFrames
+    coordinates_df = pd.read_csv(coordinates_csv, usecols=['city_id', 'latitude', 'longitude']).dropna()
+
+    # Update all cities in one transaction
+    with engine.begin() as connection:
+        connection.execute(
+            text("UPDATE city SET latitude = :latitude, longitude = :longitude WHERE city_id = :city_id"),
+            coordinates_df.to_dict('records')
+        )
+
+    print(f"Coordinates set for {len(coordinates_df)} cities.")
+
 def populate_provinces():
     # Create a database engine
     engine = create_engine(DATABASE_URL)
@@ -104,6 +151,7 @@ def populate_users():
 
     # Insert the data into the database
     user_df.to_sql('users', engine, if_exists='append', index=False)
+    sync_id_sequence(engine, 'users', 'user_id', USER_ID_SEQUENCE)
 
     print("Data has been successfully inserted into the database.")
 
@@ -147,8 +195,20 @@ def populate_user_book_ratings():
     # Read the CSV files into DataFrames
     user_book_rating_df = pd.read_csv(user_book_rating_csv, nrows=100000)
 
-    # Insert the data into the database
-    user_book_rating_df.to_sql('user_book_ratings', engine, if_exists='append', index=False)
+    # Insert the data in one transaction with the rating triggers suspended;
+    # the aggregates are rebuilt once, set-based, after the last chunk
+    with engine.begin() as connection:
+        defer_rating_aggregates(connection)
+        user_book_rating_df.to_sql(
+            'user_book_ratings',
+            connection,
+            if_exists='append',
+            index=False,
+            method='multi',
+            chunksize=5000
+        )
+        # Recompute the global and per-book aggregates from the loaded ratings
+        connection.execute(text("SELECT rebuild_rating_aggregates()"))
 
     print("Data has been successfully inserted into the database.")
 
@@ -162,8 +222,8 @@ def populate_listed_books():
     
     try:
         # Get all user_ids and book_ids from the database
-        user_ids = [user.user_id for user in session.query(User).all()]
-        book_ids = [book.book_id for book in session.query(Book).all()]
+        user_ids = [user_id for (user_id,) in session.query(User.user_id).all()]
+        book_ids = [book_id for (book_id,) in session.query(Book.book_id).all()]
         
         if not user_ids or not book_ids:
             print("Error: No users or books found in the database")
@@ -177,23 +237,11 @@ def populate_listed_books():
         # Create random listings
         created_listings = set()  # To avoid duplicates
         for _ in range(num_listings):
-            user_id = random.choice(user_ids)
-            book_id = random.choice(book_ids)
-            
-            # Check for duplicates since user_id and book_id form a composite key
-            if (user_id, book_id) not in created_listings:
-                try:
-                    # Use the list_book function from crud.py
-                    list_book(session, user_id, book_id)
-                    created_listings.add((user_id, book_id))
-                except Exception as e:
-                    print(f"Error listing book {book_id} for user {user_id}: {str(e)}")
-                    session.rollback()
-                    continue
+            created_listings.add((random.choice(user_ids), random.choice(book_ids)))
         
-        # Commit all changes
-        session.commit()
-        print(f"Successfully created {len(created_listings)} book listings in the database.")
+        # Insert all listings in a single transaction
+        count = bulk_list_books(session, created_listings)
+        print(f"Successfully created {count} book listings in the database.")
         
     except Exception as e:
         print(f"Error in populate_listed_books: {str(e)}")
@@ -205,6 +253,7 @@ def populate_listed_books():
 if __name__ == "__main__":
     # populate_books()
     # populate_cities()
+    # populate_city_coordinates()
     # populate_provinces()
     # populate_districts()
     # populate_province_district()
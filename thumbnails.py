@@ -0,0 +1,307 @@
+import argparse
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# On-disk cache of resized cover images. Thumbnails are stored once per
+# content hash under blobs/; keys/ maps (url, width) to the blob.
+CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", ".thumbnail_cache")
+MAX_CACHE_BYTES = int(os.getenv("THUMBNAIL_CACHE_MB", "256")) * 1024 * 1024
+EVICT_TO_FRACTION = 0.9  # Evict down to this share of the limit so eviction is not rerun on every store
+
+# Widths the pages render covers at; stored at PIXEL_DENSITY times the size for sharp high-DPI rendering
+PREWARM_WIDTHS = (50, 80, 100, 200)
+PIXEL_DENSITY = 2
+IMAGE_QUALITY = 80
+
+FETCH_TIMEOUT_SECONDS = 5
+MAX_ORIGIN_BYTES = 5 * 1024 * 1024
+FAILURE_RETRY_SECONDS = 600  # Don't retry a broken cover URL more often than this
+MAX_TRACKED_FAILURES = 1024
+FETCH_WORKERS = 4
+# cover_image_url is user data: never read file://, ftp:// or other schemes
+ORIGIN_SCHEMES = ("http", "https")
+
+
+def _check_scheme(url):
+    if urllib.parse.urlsplit(url).scheme.lower() not in ORIGIN_SCHEMES:
+        raise ValueError(f"unsupported cover image URL scheme: {url}")
+
+
+class _OriginRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follow redirects only to http/https URLs."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        _check_scheme(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_origin_opener = urllib.request.build_opener(_OriginRedirectHandler)
+
+
+def fetch_origin(url):
+    """Download a cover image from its origin over http or https."""
+    _check_scheme(url)
+    request = urllib.request.Request(url, headers={"User-Agent": "Booxchange thumbnailer"})
+    with _origin_opener.open(request, timeout=FETCH_TIMEOUT_SECONDS) as response:
+        data = response.read(MAX_ORIGIN_BYTES + 1)
+    if len(data) > MAX_ORIGIN_BYTES:
+        raise ValueError(f"cover image larger than {MAX_ORIGIN_BYTES} bytes")
+    return data
+
+
+_fetch = fetch_origin
+_executor = None
+_lock = threading.Lock()
+_pending = set()  # (url, width) being generated in the background
+_failures = {}  # url -> monotonic time of the last failed fetch, oldest first
+_cache_bytes = None  # Size of blobs/ and keys/, scanned on first store
+_pillow_missing = False
+
+
+def set_origin_fetcher(fetch):
+    """
+    Replace how cover images are downloaded, e.g. with a local stand-in
+    origin for tests or a prewarm run.
+
+    Args:
+        fetch (callable): fetch(url) -> bytes of the original image; None
+            restores fetch_origin
+    """
+    global _fetch
+    _fetch = fetch or fetch_origin
+
+
+def _digest(value):
+    return hashlib.sha256(value).hexdigest()
+
+
+def _key_path(url, width):
+    key = _digest(f"{width}:{url}".encode("utf-8"))
+    return os.path.join(CACHE_DIR, "keys", key[:2], key)
+
+
+def _blob_path(name):
+    return os.path.join(CACHE_DIR, "blobs", name[:2], name)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def cached_thumbnail(url, width):
+    """
+    Look up a cached thumbnail.
+
+    Returns:
+        str: Path of the thumbnail file, or None if it is not cached
+    """
+    try:
+        with open(_key_path(url, width), encoding="ascii") as f:
+            path = _blob_path(f.read().strip())
+        os.utime(path)  # Mark as recently used for eviction
+    except (FileNotFoundError, ValueError):
+        return None
+    return path
+
+
+def _resize(data, width):
+    """Resize an image to width, as WebP where Pillow supports it, else JPEG."""
+    from PIL import Image, features
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((width * PIXEL_DENSITY, width * PIXEL_DENSITY * 10))
+        output = io.BytesIO()
+        if features.check("webp"):
+            image.save(output, format="WEBP", quality=IMAGE_QUALITY)
+            return output.getvalue(), ".webp"
+        image.convert("RGB").save(output, format="JPEG", quality=IMAGE_QUALITY, optimize=True)
+        return output.getvalue(), ".jpg"
+
+
+def _store(url, width, thumbnail, extension):
+    name = _digest(thumbnail) + extension
+    path = _blob_path(name)
+    key_path = _key_path(url, width)
+    added = 0
+    if not os.path.exists(path):
+        _write_atomic(path, thumbnail)
+        added += len(thumbnail)
+    if not os.path.exists(key_path):
+        added += len(name)
+    _write_atomic(key_path, name.encode("ascii"))
+    if added:
+        _evict(added)
+    return path
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _evict(added):
+    """
+    Delete least recently used thumbnails, together with the keys pointing
+    at them, once blobs and keys exceed MAX_CACHE_BYTES.
+    """
+    global _cache_bytes
+    with _lock:
+        blobs_dir = os.path.join(CACHE_DIR, "blobs")
+        keys_dir = os.path.join(CACHE_DIR, "keys")
+        if _cache_bytes is None:
+            _cache_bytes = sum(entry.stat().st_size for entry in _scan(blobs_dir))
+            _cache_bytes += sum(entry.stat().st_size for entry in _scan(keys_dir))
+        else:
+            _cache_bytes += added
+        if _cache_bytes <= MAX_CACHE_BYTES:
+            return
+
+        blobs = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.name, entry.path) for entry in _scan(blobs_dir))
+        keys_by_blob = {}  # blob name -> [(key path, size)]
+        for entry in _scan(keys_dir):
+            try:
+                with open(entry.path, encoding="ascii") as f:
+                    name = f.read().strip()
+            except (FileNotFoundError, ValueError):
+                continue
+            keys_by_blob.setdefault(name, []).append((entry.path, entry.stat().st_size))
+
+        # Keys whose blob is already gone only take up space
+        existing = {name for _, _, name, _ in blobs}
+        for name in set(keys_by_blob) - existing:
+            for key_path, size in keys_by_blob.pop(name):
+                if _remove(key_path):
+                    _cache_bytes -= size
+
+        for _, size, name, path in blobs:
+            if _cache_bytes <= MAX_CACHE_BYTES * EVICT_TO_FRACTION:
+                break
+            if _remove(path):
+                _cache_bytes -= size
+            for key_path, key_size in keys_by_blob.pop(name, ()):
+                if _remove(key_path):
+                    _cache_bytes -= key_size
+
+
+def _record_failure(url):
+    """Remember a failed fetch, keeping only recent failures and at most MAX_TRACKED_FAILURES."""
+    now = time.monotonic()
+    with _lock:
+        _failures.pop(url, None)
+        _failures[url] = now
+        for failed_url, failed_at in list(_failures.items()):
+            if len(_failures) <= MAX_TRACKED_FAILURES and now - failed_at < FAILURE_RETRY_SECONDS:
+                break
+            del _failures[failed_url]
+
+
+def _scan(directory):
+    if not os.path.isdir(directory):
+        return
+    for shard in os.scandir(directory):
+        if shard.is_dir():
+            yield from (entry for entry in os.scandir(shard.path) if entry.is_file() and not entry.name.endswith(".tmp"))
+
+
+def generate_thumbnails(url, widths):
+    """
+    Fetch a cover once and store a thumbnail for each width that is missing.
+
+    Returns:
+        dict: width -> thumbnail path, only for widths that are now cached
+    """
+    global _pillow_missing
+    paths = {width: cached_thumbnail(url, width) for width in widths}
+    missing = [width for width, path in paths.items() if path is None]
+    if not missing:
+        return paths
+    failed_at = _failures.get(url)
+    if _pillow_missing or (failed_at is not None and time.monotonic() - failed_at < FAILURE_RETRY_SECONDS):
+        return {width: path for width, path in paths.items() if path}
+
+    try:
+        original = _fetch(url)
+        for width in missing:
+            paths[width] = _store(url, width, *_resize(original, width))
+        with _lock:
+            _failures.pop(url, None)
+    except ImportError:
+        print("Pillow is not installed; serving cover images from their origin")
+        _pillow_missing = True
+    except Exception as e:
+        print(f"Could not create thumbnail for {url}: {e}")
+        _record_failure(url)
+    return {width: path for width, path in paths.items() if path}
+
+
+def _generate_in_background(url, width):
+    try:
+        generate_thumbnails(url, (width,))
+    finally:
+        with _lock:
+            _pending.discard((url, width))
+
+
+def cover_source(url, width):
+    """
+    Return what to pass to st.image for a cover shown at width pixels: the
+    cached thumbnail if there is one, otherwise the original URL while the
+    thumbnail is generated in the background.
+    """
+    global _executor
+    if not url:
+        return url
+    path = cached_thumbnail(url, width)
+    if path:
+        return path
+    if _pillow_missing:
+        return url
+    with _lock:
+        if (url, width) not in _pending:
+            _pending.add((url, width))
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="thumbnails")
+            _executor.submit(_generate_in_background, url, width)
+    return url
+
+
+def prewarm(widths=PREWARM_WIDTHS, workers=8):
+    """
+    Generate thumbnails for the covers of all listed books.
+
+    Args:
+        widths (tuple): Thumbnail widths to generate for every cover
+        workers (int): Number of covers fetched concurrently
+
+    Returns:
+        int: Number of distinct covers processed
+    """
+    from location_filter import iter_listings
+
+    urls = {listing.cover_image_url for listing in iter_listings() if listing.cover_image_url}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(lambda url: generate_thumbnails(url, widths), urls):
+            pass
+    return len(urls)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate cover thumbnails for all listed books.")
+    parser.add_argument("--width", type=int, action="append", help="thumbnail width (repeatable)")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent cover downloads")
+    args = parser.parse_args()
+    count = prewarm(tuple(args.width or PREWARM_WIDTHS), args.workers)
+    print(f"Prewarmed thumbnails for {count} covers in {CACHE_DIR}")
@@ -1,11 +1,12 @@
 import re
 
-import numpy as np
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-
 
 def search(query):
+    # Imported on first search so loading the app doesn't pay for pandas/sklearn
+    import numpy as np
+    import pandas as pd
+    from sklearn.metrics.pairwise import cosine_similarity
+
     vectorizer = pd.read_pickle("pkl_files/vectorizer_searchengine.pkl")
     titles = pd.read_pickle("pkl_files/book_titles.pkl")
     processed_query = re.sub("[^a-zA-Z0-9 ]", "", query.lower())